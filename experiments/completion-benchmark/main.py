@@ -0,0 +1,171 @@
+import argparse
+import asyncio
+import json
+import threading
+import time
+from multiprocessing.dummy import Pool
+import openai
+from aiohttp import web
+from quizicist import completion
+from quizicist.consts import JSON_MODEL, MODEL_PROFILES
+from quizicist.errors import ExecutorSaturatedError
+from quizicist.executor import get_executor
+from quizicist.prompt import Prompt, PromptType
+
+HOST = "127.0.0.1"
+PORT = 8765
+
+SHARDS = ["Shard content. " * 200] * 3
+NUM_QUESTIONS = 15
+QUESTION = { "question": "question", "correct": "a", "incorrect": ["b", "c", "d"] }
+
+
+# mock chat completions endpoint, responding after a fixed latency
+def mock_app(latency):
+    async def chat_completions(request):
+        body = await request.json()
+        await asyncio.sleep(latency)
+
+        num_questions = body["max_tokens"] // MODEL_PROFILES[body["model"]].question_size
+        questions = [dict(QUESTION, question=f"question {index}") for index in range(num_questions)]
+        content = json.dumps(questions) if body["model"] == JSON_MODEL else "questions"
+
+        if body.get("stream"):
+            response = web.StreamResponse(headers={ "Content-Type": "text/event-stream" })
+            await response.prepare(request)
+
+            chunk = { "choices": [{ "index": 0, "delta": { "content": content }, "finish_reason": None }] }
+            await response.write(f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n".encode())
+            return response
+
+        return web.json_response({
+            "id": "mock",
+            "object": "chat.completion",
+            "created": 0,
+            "model": body["model"],
+            "choices": [{ "index": 0, "message": { "role": "assistant", "content": content }, "finish_reason": "stop" }],
+            "usage": { "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0 },
+        })
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    return app
+
+
+def start_server(latency):
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(mock_app(latency))
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, HOST, PORT).start())
+
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+
+# previous implementation: a thread per shard job, blocking on the synchronous client
+def run_gpt3_blocking(shard, num_questions, custom_prompt, prompt_type, model):
+    prompt = Prompt(custom_prompt=custom_prompt, prompt_type=prompt_type, num_questions=num_questions)\
+        .add_system_prompt()\
+        .add_message(role="user", content=shard)
+
+    openai.ChatCompletion.create(
+        model=model,
+        messages=prompt.messages,
+        max_tokens=num_questions * MODEL_PROFILES[model].question_size,
+    )
+
+    completion = openai.ChatCompletion.create(
+        model=JSON_MODEL,
+        messages=prompt.messages,
+        max_tokens=num_questions * MODEL_PROFILES[JSON_MODEL].question_size,
+    )
+
+    return json.loads(completion["choices"][0]["message"]["content"])
+
+
+def complete_shards_blocking(shards, num_questions):
+    jobs = completion.divide_questions(shards, num_questions, None, PromptType.MCQ)
+
+    with Pool(len(jobs)) as pool:
+        return pool.starmap(run_gpt3_blocking, [job[1:] for job in jobs])
+
+
+def benchmark_threads(uploads):
+    with Pool(uploads) as pool:
+        pool.starmap(complete_shards_blocking, [(SHARDS, NUM_QUESTIONS)] * uploads)
+
+
+def benchmark_async(uploads, concurrency):
+    async def run():
+        await asyncio.gather(*[
+            completion.complete_shards_async(SHARDS, NUM_QUESTIONS, concurrency=concurrency)
+            for _ in range(uploads)
+        ])
+
+    asyncio.run(run())
+
+
+# uploads from concurrent request threads sharing the process-wide executor
+def benchmark_executor(uploads):
+    latencies = []
+    rejected = 0
+
+    def upload():
+        nonlocal rejected
+        start = time.perf_counter()
+
+        try:
+            completion.complete_shards(SHARDS, NUM_QUESTIONS)
+            latencies.append(time.perf_counter() - start)
+        except ExecutorSaturatedError:
+            rejected += 1
+
+    with Pool(uploads) as pool:
+        pool.starmap(upload, [()] * uploads)
+
+    latencies.sort()
+    gauges = get_executor().gauges()
+    print(f"  executor: {gauges['max_in_flight']} in flight, {gauges['max_queued']} queued, {rejected} uploads rejected")
+    print(f"  latency: p50 {latencies[len(latencies) // 2]:.2f}s, p95 {latencies[int(len(latencies) * 0.95)]:.2f}s")
+
+
+def measure(name, uploads, benchmark):
+    peak_threads = threading.active_count()
+    done = threading.Event()
+
+    def sample_threads():
+        nonlocal peak_threads
+        while not done.wait(0.01):
+            peak_threads = max(peak_threads, threading.active_count())
+
+    sampler = threading.Thread(target=sample_threads)
+    sampler.start()
+
+    start = time.perf_counter()
+    benchmark()
+    elapsed = time.perf_counter() - start
+
+    done.set()
+    sampler.join()
+
+    jobs = uploads * len(SHARDS)
+    print(f"{name:<24} {elapsed:>8.2f}s {jobs / elapsed:>10.1f} jobs/s {peak_threads:>8} peak threads")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare thread pool and asyncio completion throughput against a mock API")
+    parser.add_argument("--uploads", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--concurrency", type=int, default=completion.COMPLETION_CONCURRENCY)
+    args = parser.parse_args()
+
+    start_server(args.latency)
+    openai.api_key = "mock"
+    openai.api_base = f"http://{HOST}:{PORT}/v1"
+
+    # silence per-job progress output
+    completion.print = lambda *_: None
+
+    print(f"{args.uploads} uploads x {len(SHARDS)} shards, {args.latency}s latency per call")
+    measure("thread pool", args.uploads, lambda: benchmark_threads(args.uploads))
+    measure("asyncio", args.uploads, lambda: benchmark_async(args.uploads, args.concurrency))
+    measure("shared executor", args.uploads, lambda: benchmark_executor(args.uploads))
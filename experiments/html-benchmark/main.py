@@ -0,0 +1,71 @@
+import pathlib
+import re
+import statistics
+import time
+import mistletoe
+from bs4 import BeautifulSoup
+from mistletoe.ast_renderer import ASTRenderer
+from quizicist.consts import TOP_LEVEL_COMPONENTS
+from quizicist.parsers.md import component_is_valid, md_parser, resolve_include, token_type
+from quizicist.tokens import count_tokens
+
+NUM_RUNS = 5
+CHAPTER_DIR = pathlib.Path(__file__).parent.resolve().parent.joinpath("plai")
+
+
+# previous text extraction, building a BeautifulSoup tree at every level of the AST
+def soup_component_text(component):
+    text = []
+
+    for child in component.children:
+        if token_type(child) == "RawText":
+            text.append(re.sub(r'{{(.*?)}}', resolve_include, child.content))
+        elif token_type(child) == "LineBreak":
+            text.append(" ")
+        elif hasattr(child, "children"):
+            text.append(soup_component_text(child))
+
+    if token_type(component) in TOP_LEVEL_COMPONENTS:
+        text.append("\n")
+
+    return BeautifulSoup("".join(text), "lxml").text
+
+
+def soup_md_parser(chapter):
+    with ASTRenderer():
+        document = mistletoe.Document(chapter)
+
+    children = list(filter(component_is_valid, document.children))
+    texts = [soup_component_text(component) for component in children]
+
+    components = [
+        { "text": text, "tokens": tokens, "heading": token_type(child) == "Heading" }
+        for child, text, tokens in zip(children, texts, count_tokens(texts))
+    ]
+    return [component for component in components if component["tokens"] > 0]
+
+
+def time_parser(parser, chapter):
+    times = []
+
+    for _ in range(NUM_RUNS):
+        start = time.perf_counter()
+        parser(chapter)
+        times.append(time.perf_counter() - start)
+
+    return statistics.median(times)
+
+
+if __name__ == "__main__":
+    print(f"{'chapter':<36}{'BeautifulSoup (ms)':>20}{'single pass (ms)':>18}{'speedup':>10}")
+
+    for path in sorted(CHAPTER_DIR.glob("*.md")):
+        chapter = path.read_text()
+
+        # both parsers must produce identical components
+        assert soup_md_parser(chapter) == md_parser(chapter)
+
+        before = time_parser(soup_md_parser, chapter)
+        after = time_parser(md_parser, chapter)
+
+        print(f"{path.name:<36}{before * 1000:>20.1f}{after * 1000:>18.1f}{before / after:>9.1f}x")
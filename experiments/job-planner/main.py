@@ -0,0 +1,73 @@
+import io
+import pathlib
+from quizicist.completion import plan_jobs, shard_chapter
+from quizicist.consts import GPT_MODEL, MODEL_PROFILES
+from quizicist.parsers.md import md_parser
+from quizicist.prompt import Prompt, PromptType
+from quizicist.tokens import count_message_tokens
+
+CHAPTER_DIR = pathlib.Path(__file__).parent.resolve().parent.joinpath("plai")
+UPLOAD_SIZES = [5, 10, 15]
+
+# results over the plai chapters (11 chapters, 12 shards), gpt-4 with the MCQ template prompt:
+#
+# questions  calls before  calls after  tokens before  tokens after
+# 5                    12           12          35440         35440
+# 10                   22           12          63650         35440
+# 15                   34           22          99090         63650
+#
+# 15 questions per chapter need 2 calls per shard, since `shard_capacity` is capped by `conversion_capacity` (11)
+
+
+# previous planner: recursively split questions into jobs of at most `questions_per_call`, repeating shards
+def divide_questions(shards, num_questions, custom_prompt, prompt_type, model=GPT_MODEL):
+    max_questions = MODEL_PROFILES[model].questions_per_call
+
+    remainder = num_questions % len(shards)
+    questions_per_shard = num_questions // len(shards)
+
+    jobs = []
+
+    if questions_per_shard > max_questions or (questions_per_shard == max_questions and remainder > 0):
+        remaining_questions = num_questions - max_questions * len(shards)
+
+        jobs.extend(divide_questions(shards, remaining_questions, custom_prompt, prompt_type, model))
+        jobs.extend(divide_questions(shards, num_questions - remaining_questions, custom_prompt, prompt_type, model))
+    else:
+        for index, shard in enumerate(shards):
+            if index < remainder:
+                jobs.append((shard, questions_per_shard + 1, custom_prompt, prompt_type, model))
+            elif questions_per_shard > 0:
+                jobs.append((shard, questions_per_shard, custom_prompt, prompt_type, model))
+
+    return jobs
+
+
+# input tokens sent for a plan's jobs
+def input_tokens(jobs):
+    total = 0
+
+    for shard, num_questions, custom_prompt, prompt_type, model in jobs:
+        prompt = Prompt(custom_prompt=custom_prompt, prompt_type=prompt_type, num_questions=num_questions)\
+            .add_system_prompt()\
+            .add_message(role="user", content=shard)
+
+        total += count_message_tokens(prompt.messages, MODEL_PROFILES[model].encoding)
+
+    return total
+
+
+if __name__ == "__main__":
+    chapters = [
+        shard_chapter(md_parser(io.StringIO(chapter.read_text())))
+        for chapter in sorted(CHAPTER_DIR.glob("*.md"))
+    ]
+
+    print(f"{len(chapters)} chapters, {sum(map(len, chapters))} shards")
+    print(f"{'questions':<10} {'calls before':>12} {'calls after':>12} {'tokens before':>14} {'tokens after':>13}")
+
+    for num_questions in UPLOAD_SIZES:
+        before = [job for shards in chapters for job in divide_questions(shards, num_questions, None, PromptType.MCQ)]
+        after = [job[1:] for shards in chapters for job in plan_jobs(shards, num_questions, None, PromptType.MCQ)]
+
+        print(f"{num_questions:<10} {len(before):>12} {len(after):>12} {input_tokens(before):>14} {input_tokens(after):>13}")
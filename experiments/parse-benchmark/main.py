@@ -0,0 +1,123 @@
+import json
+import pathlib
+import re
+import statistics
+import tempfile
+import time
+import warnings
+import mistletoe
+from bs4 import BeautifulSoup, MarkupResemblesLocatorWarning
+from mistletoe.ast_renderer import ASTRenderer
+from transformers import GPT2Tokenizer
+from transformers.models.gpt2.tokenization_gpt2 import bytes_to_unicode
+from quizicist import tokens
+from quizicist.consts import TOP_LEVEL_COMPONENTS
+from quizicist.parsers.md import md_parser, resolve_include
+
+NUM_RUNS = 5
+CHAPTER_DIR = pathlib.Path(__file__).parent.resolve().parent.joinpath("plai")
+MERGES_PATH = pathlib.Path(tokens.__file__).parent.joinpath("data", "gpt2-vocab.bpe")
+
+
+# the baseline's `GPT2Tokenizer.from_pretrained("gpt2")`, built from the bundled merges so it runs offline
+# ids follow GPT-2's vocabulary order (bytes, then merges), so counts are the same as the pretrained tokenizer's
+def load_slow_tokenizer():
+    merges = [tuple(line.split()) for line in MERGES_PATH.read_text(encoding="utf-8").splitlines()[1:] if line]
+    vocab = list(bytes_to_unicode().values()) + ["".join(merge) for merge in merges] + ["<|endoftext|>"]
+
+    directory = pathlib.Path(tempfile.mkdtemp())
+    directory.joinpath("vocab.json").write_text(json.dumps({ token: index for index, token in enumerate(vocab) }))
+    directory.joinpath("merges.txt").write_text(MERGES_PATH.read_text(encoding="utf-8"), encoding="utf-8")
+
+    tokenizer = GPT2Tokenizer(str(directory.joinpath("vocab.json")), str(directory.joinpath("merges.txt")))
+
+    # `from_pretrained` registers special tokens so they're never split, as in the pretrained tokenizer
+    tokenizer.sanitize_special_tokens()
+    return tokenizer
+
+
+slow_tokenizer = load_slow_tokenizer()
+
+# components that look like filenames or URLs are parsed as markup all the same
+warnings.filterwarnings("ignore", category=MarkupResemblesLocatorWarning)
+
+
+# baseline parser: JSON AST round trip, BeautifulSoup per component and one slow tokenizer call per component
+def find_component_text(component):
+    text = []
+
+    for child in component["children"]:
+        if child["type"] == "RawText":
+            text.append(re.sub(r'{{(.*?)}}', resolve_include, child["content"]))
+
+        elif child["type"] == "LineBreak":
+            text.append(" ")
+
+        elif "children" in child:
+            text.append(find_component_text(child))
+
+    if component["type"] in TOP_LEVEL_COMPONENTS:
+        text.append("\n")
+
+    return BeautifulSoup("".join(text), "lxml").text
+
+
+def baseline_md_parser(chapter):
+    parsed = json.loads(mistletoe.markdown(chapter, ASTRenderer))
+    components = []
+
+    for component in parsed["children"]:
+        if component["type"] not in TOP_LEVEL_COMPONENTS:
+            continue
+
+        text = find_component_text(component)
+        num_tokens = len(slow_tokenizer(text)["input_ids"])
+
+        if num_tokens > 0:
+            components.append({ "text": text, "tokens": num_tokens })
+
+    return components
+
+
+# forget every memoized count, the shared cache of whole texts and each BPE counter's cache of pieces
+def clear_token_caches():
+    with tokens.token_cache_lock:
+        tokens.token_cache.clear()
+
+    for counter in tokens.tokenizers.values():
+        count_piece = getattr(getattr(counter, "__self__", None), "count_piece", None)
+
+        if hasattr(count_piece, "cache_clear"):
+            count_piece.cache_clear()
+
+
+# median wall-clock time for parsing a chapter
+def time_parser(parser, chapter, cold=False):
+    times = []
+
+    for _ in range(NUM_RUNS):
+        if cold:
+            clear_token_caches()
+
+        start = time.perf_counter()
+        parser(chapter)
+        times.append(time.perf_counter() - start)
+
+    return statistics.median(times)
+
+
+if __name__ == "__main__":
+    print(f"{'chapter':<36}{'baseline (ms)':>15}{'cold (ms)':>12}{'warm (ms)':>12}{'speedup, cold':>15}")
+
+    for path in sorted(CHAPTER_DIR.glob("*.md")):
+        chapter = path.read_text()
+
+        # parsers must agree on components (token counts differ once the model's encoding is used)
+        texts = lambda components: [component["text"] for component in components]
+        assert texts(baseline_md_parser(chapter)) == texts(md_parser(chapter)), path.name
+
+        baseline = time_parser(baseline_md_parser, chapter)
+        cold = time_parser(md_parser, chapter, cold=True)
+        warm = time_parser(md_parser, chapter)
+
+        print(f"{path.name:<36}{baseline * 1000:>15.1f}{cold * 1000:>12.1f}{warm * 1000:>12.1f}{baseline / cold:>14.1f}x")
@@ -0,0 +1,68 @@
+import argparse
+import json
+import subprocess
+import sys
+
+# each stage runs in a fresh interpreter, reporting wall time and peak RSS
+STAGES = {
+    "import quizicist": "import quizicist",
+    "import parsers": "import quizicist.parsers.md, quizicist.parsers.text",
+    "first token count": "from quizicist.tokens import count_tokens; count_tokens(['hello world'])",
+    "first token count (transformers)": "from quizicist.tokens import count_tokens; count_tokens(['hello world'], counter='transformers')",
+}
+
+MEASURE = """
+import json, resource, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": elapsed,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}}))
+"""
+
+
+def measure_stage(statement):
+    output = subprocess.check_output([sys.executable, "-c", MEASURE.format(statement=statement)])
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+# resident and proportional (copy-on-write shared pages split across processes) memory
+def process_memory(pid):
+    memory = {}
+
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ["Rss", "Pss", "Shared_Clean", "Shared_Dirty"]:
+                memory[key] = int(value.split()[0]) / 1024
+
+    return memory
+
+
+def worker_pids(master_pid):
+    with open(f"/proc/{master_pid}/task/{master_pid}/children") as f:
+        return [int(pid) for pid in f.read().split()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure quizicist import time and worker memory")
+    parser.add_argument("--gunicorn-pid", type=int, help="PID of a running gunicorn master (Linux only)")
+    args = parser.parse_args()
+
+    print(f"{'stage':<36}{'seconds':>10}{'max RSS (MB)':>16}")
+    for name, statement in STAGES.items():
+        result = measure_stage(statement)
+        print(f"{name:<36}{result['seconds']:>10.2f}{result['max_rss_mb']:>16.1f}")
+
+    if args.gunicorn_pid:
+        print()
+        print(f"{'process':<24}{'RSS (MB)':>10}{'PSS (MB)':>10}{'shared (MB)':>14}")
+
+        pids = [args.gunicorn_pid] + worker_pids(args.gunicorn_pid)
+        for pid in pids:
+            memory = process_memory(pid)
+            shared = memory["Shared_Clean"] + memory["Shared_Dirty"]
+            name = "master" if pid == args.gunicorn_pid else f"worker {pid}"
+            print(f"{name:<24}{memory['Rss']:>10.1f}{memory['Pss']:>10.1f}{shared:>14.1f}")
@@ -0,0 +1,184 @@
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import io
+import json
+import pathlib
+import random
+import re
+import statistics
+import openai
+from quizicist import completion
+from quizicist.consts import GPT_MODEL, JSON_MODEL
+from quizicist.parsers.md import md_parser
+from quizicist.prompt import OutputFormat, PromptType
+from quizicist.retry import RetryBudget
+from quizicist.tokens import count_message_tokens, count_tokens
+
+EXPERIMENTS_DIR = pathlib.Path(__file__).parent.resolve().parent
+CHAPTER_DIR = EXPERIMENTS_DIR.joinpath("plai")
+EXAMPLE_DIR = EXPERIMENTS_DIR.joinpath("edit-mode-to-json")
+
+NUM_QUESTIONS = 5
+
+# simulated latency per call: a fixed overhead plus a cost per generated token, in seconds
+# each call's latency is scaled by a log-normal factor with this spread, as API latency varies from call to call
+LATENCY = {
+    GPT_MODEL: (0.8, 0.06),
+    JSON_MODEL: (0.4, 0.015),
+}
+LATENCY_SPREAD = 0.35
+
+
+def load_example(name):
+    text = EXAMPLE_DIR.joinpath(name).read_text()
+
+    draft = re.search(r"# Input\n```\n(.*?)```", text, re.DOTALL).group(1)
+    converted = re.search(r"## Output 1\n```json\n(.*?)```", text, re.DOTALL).group(1)
+
+    return draft, json.loads(converted)
+
+
+def messages_key(messages):
+    return hashlib.sha256(json.dumps(messages, sort_keys=True).encode()).hexdigest()
+
+
+# stands in for the chat API: replays recorded responses when available, otherwise returns the
+# edit-mode examples in the requested format, malformed at `malformed_rate`
+class MockChatCompletion:
+    def __init__(self, malformed_rate, responses_dir=None, seed=0):
+        self.malformed_rate = malformed_rate
+        self.responses_dir = responses_dir
+        self.random = random.Random(seed)
+
+        self.template, self.converted = load_example("lifetimes-well-formatted-1.md")
+        self.malformed, _ = load_example("lifetimes-malformatted-0.md")
+
+        # virtual seconds, calls per model and malformed drafts for the current job
+        self.reset()
+
+    def reset(self):
+        self.latency = 0
+        self.calls = { GPT_MODEL: 0, JSON_MODEL: 0 }
+        self.malformed_drafts = 0
+
+    def generate(self, model, messages):
+        if self.responses_dir:
+            recorded = pathlib.Path(self.responses_dir).joinpath(messages_key(messages) + ".txt")
+            if recorded.exists():
+                return recorded.read_text()
+
+        # conversions always succeed, so failures only cost the extra call
+        if model == JSON_MODEL:
+            return json.dumps(self.converted)
+
+        malformed = self.random.random() < self.malformed_rate
+        self.malformed_drafts += malformed
+
+        if "JSON array" in messages[0]["content"]:
+            questions = json.dumps(self.converted, indent=2)
+            return questions[:len(questions) // 2] if malformed else questions
+
+        return self.malformed if malformed else self.template
+
+    async def acreate(self, model, messages, stream=False, **kwargs):
+        content = self.generate(model, messages)
+        prompt_tokens = count_message_tokens(messages)
+        [completion_tokens] = count_tokens([content])
+
+        scale = self.random.lognormvariate(0, LATENCY_SPREAD)
+        base, per_token = (cost * scale for cost in LATENCY[model])
+        self.latency += base
+        self.calls[model] += 1
+
+        # streamed responses are charged for the tokens read before the stream is closed
+        if stream:
+            async def chunks():
+                for line in content.splitlines(keepends=True):
+                    self.latency += count_tokens([line])[0] * per_token
+                    yield { "choices": [{ "index": 0, "delta": { "content": line } }] }
+
+            return chunks()
+
+        self.latency += completion_tokens * per_token
+
+        return {
+            "choices": [{ "index": 0, "message": { "role": "assistant", "content": content }, "finish_reason": "stop" }],
+            "usage": { "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens },
+        }
+
+
+def load_shards():
+    shards = []
+
+    for chapter in sorted(CHAPTER_DIR.glob("*.md")):
+        components = md_parser(io.StringIO(chapter.read_text()))
+        shards.extend(completion.shard_chapter(components))
+
+    return shards
+
+
+# latency percentile of sorted `values`
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_mode(mock, shards, output_format, stream, runs):
+    latencies = []
+    first_questions = []
+    tokens = []
+    drafts = 0
+    malformed = 0
+    conversions = 0
+
+    for shard in shards * runs:
+        mock.reset()
+        budget = RetryBudget()
+        first_question = []
+
+        # silence the pipeline's progress output
+        with contextlib.redirect_stdout(io.StringIO()):
+            asyncio.run(completion.run_gpt3_async(
+                shard, NUM_QUESTIONS, None, PromptType.MCQ, budget=budget, output_format=output_format, stream=stream,
+                on_question=lambda _: first_question.append(mock.latency),
+            ))
+
+        latencies.append(mock.latency)
+        first_questions.append(first_question[0])
+        tokens.append(budget.tokens)
+
+        # drafts that couldn't be parsed locally fall back to a conversion call
+        drafts += mock.calls[GPT_MODEL]
+        malformed += mock.malformed_drafts
+        conversions += mock.calls[JSON_MODEL]
+
+    latencies.sort()
+    first_questions.sort()
+    mode = f"{output_format.name.lower()}{', streamed' if stream else ''}"
+    print(
+        f"{mode:<18}"
+        f" {statistics.median(first_questions):>8.1f}s {statistics.median(latencies):>8.1f}s {percentile(latencies, 0.95):>8.1f}s"
+        f" {statistics.mean(tokens):>10.0f} {malformed / drafts:>10.1%} {conversions / drafts:>15.1%}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare template and JSON output formats for question generation")
+    parser.add_argument("--malformed-rate", type=float, default=0.1)
+    parser.add_argument("--runs", type=int, default=5, help="passes over every shard, each drawing new malformed drafts and latencies")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--responses", help="directory of recorded responses, named by the hash of their messages")
+    args = parser.parse_args()
+
+    openai.api_key = "mock"
+
+    shards = load_shards()
+    print(f"{len(shards)} shards x {args.runs} runs, {NUM_QUESTIONS} questions each, {args.malformed_rate:.0%} malformed drafts")
+    print(f"{'format':<18} {'first':>9} {'p50':>9} {'p95':>9} {'tokens':>10} {'malformed':>10} {'parse failures':>15}")
+
+    for output_format in OutputFormat:
+        for stream in [False, True]:
+            mock = MockChatCompletion(args.malformed_rate, args.responses, args.seed)
+            openai.ChatCompletion.acreate = mock.acreate
+            run_mode(mock, shards, output_format, stream, args.runs)
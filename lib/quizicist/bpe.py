@@ -0,0 +1,162 @@
+from __future__ import annotations
+import base64
+import functools
+import os
+from typing import Dict, Iterable, Iterator, List, Tuple
+import regex
+
+# merge tables shipped with the package
+DATA_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "data")
+
+# pre-tokenization pattern used by GPT-2 (identical to `GPT2Tokenizer.pat`)
+GPT2_PATTERN = r"""'s|'t|'re|'ve|'m|'ll|'d| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+"""
+
+# pre-tokenization pattern used by cl100k_base (gpt-3.5-turbo, gpt-4)
+CL100K_PATTERN = r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\p{L}\p{N}]?+\p{L}++|\p{N}{1,3}+| ?[^\s\p{L}\p{N}]++[\r\n]*+|\s++$|\s*[\r\n]|\s+(?!\S)|\s"""
+
+# special tokens, each counted as a single token
+ENDOFTEXT = "<|endoftext|>"
+CL100K_SPECIAL_TOKENS = [ENDOFTEXT, "<|fim_prefix|>", "<|fim_middle|>", "<|fim_suffix|>", "<|endofprompt|>"]
+
+# number of distinct pre-tokenized pieces whose token counts are memoized
+PIECE_CACHE_SIZE = 65536
+
+
+# reversible mapping from bytes to the printable characters used in GPT-2 merge files
+def bytes_to_unicode() -> Dict[int, str]:
+    printable = list(range(ord("!"), ord("~") + 1)) \
+        + list(range(ord("¡"), ord("¬") + 1)) \
+        + list(range(ord("®"), ord("ÿ") + 1))
+
+    characters = printable[:]
+    offset = 0
+    for byte in range(2**8):
+        if byte not in printable:
+            printable.append(byte)
+            characters.append(2**8 + offset)
+            offset += 1
+
+    return dict(zip(printable, map(chr, characters)))
+
+
+# byte-level BPE, merging the adjacent pair whose concatenation has the lowest rank
+class BytePairEncoding:
+    ranks: Dict[bytes, int]
+    pattern: regex.Pattern
+    special_pattern: None | regex.Pattern
+
+    def __init__(self, ranks: Dict[bytes, int], pattern: str, special_tokens: Iterable[str] = ()):
+        self.ranks = ranks
+        self.pattern = regex.compile(pattern)
+
+        special_tokens = list(special_tokens)
+        self.special_pattern = regex.compile("|".join(map(regex.escape, special_tokens))) if special_tokens else None
+
+        # memoize per instance, repeated words are tokenized once
+        self.count_piece = functools.lru_cache(maxsize=PIECE_CACHE_SIZE)(self.count_piece)
+
+    # number of tokens a single pre-tokenized piece merges into
+    def count_piece(self, piece: bytes) -> int:
+        if piece in self.ranks:
+            return 1
+
+        parts = [piece[i:i + 1] for i in range(len(piece))]
+
+        while len(parts) > 1:
+            best_rank = None
+            best_index = None
+
+            for index in range(len(parts) - 1):
+                rank = self.ranks.get(parts[index] + parts[index + 1])
+
+                if rank is not None and (best_rank is None or rank < best_rank):
+                    best_rank = rank
+                    best_index = index
+
+            if best_index is None:
+                break
+
+            parts[best_index:best_index + 2] = [parts[best_index] + parts[best_index + 1]]
+
+        return len(parts)
+
+    # split text around special tokens, yielding (text, is_special) pairs
+    def split_special(self, text: str) -> Iterator[Tuple[str, bool]]:
+        if self.special_pattern is None:
+            yield text, False
+            return
+
+        start = 0
+        for match in self.special_pattern.finditer(text):
+            yield text[start:match.start()], False
+            yield match.group(), True
+            start = match.end()
+
+        yield text[start:], False
+
+    def count(self, text: str) -> int:
+        tokens = 0
+
+        for chunk, is_special in self.split_special(text):
+            if is_special:
+                tokens += 1
+                continue
+
+            for piece in self.pattern.findall(chunk):
+                tokens += self.count_piece(piece.encode("utf-8"))
+
+        return tokens
+
+    def count_batch(self, texts: Iterable[str]) -> List[int]:
+        return [self.count(text) for text in texts]
+
+
+# load GPT-2 merge table (`vocab.bpe`) as byte ranks
+def load_gpt2() -> BytePairEncoding:
+    byte_decoder = {character: byte for byte, character in bytes_to_unicode().items()}
+    decode = lambda symbol: bytes(byte_decoder[character] for character in symbol)
+
+    # single bytes are always tokens, merged tokens are ranked by merge order
+    ranks = {bytes([byte]): byte for byte in range(2**8)}
+
+    with open(os.path.join(DATA_DIR, "gpt2-vocab.bpe"), encoding="utf-8") as f:
+        # skip version header
+        next(f)
+
+        for line in f:
+            if not line.strip():
+                continue
+
+            first, second = line.split()
+            ranks[decode(first) + decode(second)] = len(ranks)
+
+    return BytePairEncoding(ranks, GPT2_PATTERN, special_tokens=[ENDOFTEXT])
+
+
+# load tiktoken rank file (one base64-encoded token and rank per line)
+def load_cl100k_base() -> BytePairEncoding:
+    ranks = {}
+
+    with open(os.path.join(DATA_DIR, "cl100k_base.tiktoken"), "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+
+            token, rank = line.split()
+            ranks[base64.b64decode(token)] = int(rank)
+
+    return BytePairEncoding(ranks, CL100K_PATTERN, special_tokens=CL100K_SPECIAL_TOKENS)
+
+
+# encodings available without network access, keyed by name
+ENCODINGS = {
+    "gpt2": load_gpt2,
+    "cl100k_base": load_cl100k_base,
+}
+
+
+def load_encoding(name: str) -> BytePairEncoding:
+    if name not in ENCODINGS:
+        raise ValueError(f"Unknown BPE encoding: {name}")
+
+    return ENCODINGS[name]()
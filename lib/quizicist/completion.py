@@ -1,116 +1,383 @@
-from math import ceil
-from multiprocessing.dummy import Pool
+import asyncio
+import contextlib
+import functools
+import math
+import aiohttp
 import openai
 import os
 from dotenv import load_dotenv
-from .consts import GPT_MODEL, MAX_CONTEXT_SIZE, ESTIMATED_QUESTION_SIZE, NUM_QUESTIONS
+from .consts import CUSTOM_PROMPT_SIZE, GPT_MODEL, MODEL_PROFILES
+from .document import Document
 from .errors import QuizicistError
-from .prompt import Prompt, PromptType
-from .postprocess import postprocess_with_gpt, postprocess_manual
+from .executor import get_executor
+from .prompt import PROMPT_VARIANTS, Prompt, PromptType
+from .retry import TRANSIENT_ERRORS, RetryBudget, RetryBudgetExceededError, failure_rates
+from .postprocess import QuestionStream, conversion_capacity, convert_draft, postprocess_manual
+from .tokens import count_message_tokens, count_tokens
 
 # set up openai
 load_dotenv()
 openai.api_key = os.getenv("OPENAI_SECRET_KEY")
 
+# number of shard jobs sent to the API at once by a single upload
+COMPLETION_CONCURRENCY = int(os.getenv("QUIZICIST_COMPLETION_CONCURRENCY", "8"))
+
+# stream generated drafts, so calls can be closed once enough questions are parsed
+STREAM_COMPLETIONS = os.getenv("QUIZICIST_STREAM_COMPLETIONS", "1") != "0"
+
+# how far past the most even split a shard may grow to end at a section heading
+SHARD_SLACK = 0.15
+
 # total number of tokens within a chapter
 def chapter_tokens(components):
+    if isinstance(components, Document):
+        return components.total_tokens
+
     return sum(map(lambda c: c["tokens"], components))
 
 
-def shard_chapter(components):
-    total_tokens = chapter_tokens(components)
-    max_tokens = total_tokens / ceil(total_tokens / MAX_CONTEXT_SIZE)
+# share one HTTP session between API calls made within the block, instead of connecting per request
+@contextlib.asynccontextmanager
+async def api_session():
+    if openai.aiosession.get() is not None:
+        yield
+        return
 
-    shards = []
-    num_tokens = 0
-    curr_prompt = ""
+    async with aiohttp.ClientSession() as session:
+        token = openai.aiosession.set(session)
 
-    for component in components:
-        component_tokens = component["tokens"]
-        component_text = component["text"]
+        try:
+            yield
+        finally:
+            openai.aiosession.reset(token)
 
-        if num_tokens < max_tokens and num_tokens + component_tokens < MAX_CONTEXT_SIZE:
-            curr_prompt += component_text
-            num_tokens += component_tokens
-        else:
-            shards.append(curr_prompt)
 
-            curr_prompt = component_text
-            num_tokens = component_tokens
+# largest system prompt (plus an empty user message) sent to the model, in tokens
+def system_prompt_size(model=GPT_MODEL):
+    profile = MODEL_PROFILES[model]
 
-    shards.append(curr_prompt)
-    return shards
+    def prompt_size(output_format, prompt_type):
+        prompt = Prompt(prompt_type=prompt_type, num_questions=profile.questions_per_call, output_format=output_format)\
+            .add_system_prompt()\
+            .add_message(role="user", content="")
 
+        return count_message_tokens(prompt.messages, profile.encoding)
 
-def run_gpt3(shard, num_questions, custom_prompt, prompt_type):
-    prompt = Prompt(custom_prompt=custom_prompt, prompt_type=prompt_type, num_questions=num_questions)\
-        .add_system_prompt()\
-        .add_message(role="user", content=shard)
+    # shards must fit every prompt variant, so output formats can change without resharding
+    return max(
+        prompt_size(output_format, prompt_type)
+        for output_format, prompts in PROMPT_VARIANTS.items()
+        for prompt_type in prompts
+    )
+
+
+# tokens available for shard content, leaving room for the system prompt and generated questions
+def shard_context_size(model=GPT_MODEL):
+    profile = MODEL_PROFILES[model]
+    output_size = profile.questions_per_call * profile.question_size
+
+    return profile.context_window - output_size - system_prompt_size(model) - CUSTOM_PROMPT_SIZE
+
+
+# split a chapter into the fewest, most even shards that fit the model's context
+# preferring boundaries at section headings
+def shard_chapter(components, model=GPT_MODEL):
+    document = Document.from_components(components)
+    bounds = document.partition(shard_context_size(model), slack=SHARD_SLACK)
+
+    return document.shards(bounds)
+
+
+# generate questions for a shard, in `output_format` or the prompt type's default format
+# questions from a short batch are kept, and later attempts only ask for the missing questions
+# calls request several candidate drafts when drafts of the prompt type are often unusable, even after conversion,
+# banking questions from unused candidates in the budget's reserve
+# streamed calls are closed as soon as all questions are parsed, each kept question is passed to `on_question`
+# a stream broken off by a transient API error keeps the questions parsed so far and counts as a retry
+async def run_gpt3_async(shard, num_questions, custom_prompt, prompt_type, model=GPT_MODEL, budget=None, output_format=None, on_question=None, stream=STREAM_COMPLETIONS):
+    budget = budget or RetryBudget()
+    profile = MODEL_PROFILES[model]
+    questions = []
+
+    # add questions not repeating ones already kept, up to `num_questions`
+    def keep(new):
+        kept = { question["question"] for question in questions }
+
+        for question in new:
+            if len(questions) < num_questions and question["question"] not in kept:
+                questions.append(question)
+                kept.add(question["question"])
+
+                if on_question:
+                    on_question(question)
+
+    # start from questions banked by earlier jobs on the same shard
+    keep(budget.withdraw(shard, num_questions))
+
+    # process question until well-formatted questions have been generated, within the retry policy
+    for attempt in range(budget.policy.max_attempts):
+        if len(questions) == num_questions:
+            return questions
+
+        missing = num_questions - len(questions)
+        prompt = Prompt(custom_prompt=custom_prompt, prompt_type=prompt_type, num_questions=missing, output_format=output_format)\
+            .add_system_prompt()\
+            .add_message(role="user", content=shard)\
+            .add_kept_questions(questions)
+
+        # ensure prompt and generated questions fit in the model's context
+        max_tokens = missing * profile.question_size
+        prompt_tokens = count_message_tokens(prompt.messages, profile.encoding)
+        if prompt_tokens + max_tokens > profile.context_window:
+            raise QuizicistError("Your prompt is too long. Please shorten your content or custom prompt and try again.")
+
+        tokens = budget.tokens
+        candidates = [QuestionStream(prompt.prompt_type, prompt.output_format) for _ in range(failure_rates.candidates(prompt.prompt_type, budget.policy))]
+
+        # questions are kept from the first candidate to complete a question
+        followed = None
+
+        def follow(index, complete):
+            nonlocal followed
+
+            if complete and followed is None:
+                followed = index
+            if index == followed:
+                keep(complete)
 
-    # process question until 5 well-formatted questions have been generated
-    # TODO: add tally for failed generations and quit after n
-    while True:
         print(f"Running completion on shard...")
-        completion = openai.ChatCompletion.create(
-            model=GPT_MODEL,
+        completion = await budget.create(
+            prompt_tokens,
+            model=model,
             messages=prompt.messages, 
-            max_tokens=NUM_QUESTIONS * ESTIMATED_QUESTION_SIZE,
+            max_tokens=max_tokens,
             temperature=0.8,
+            n=len(candidates),
+            stream=stream,
         )
-        
+
+        # stop reading once all questions are kept, without paying for the rest of the stream
+        ended = True
+        interrupted = False
+        if stream:
+            try:
+                async for chunk in completion:
+                    for choice in chunk["choices"]:
+                        follow(choice["index"], candidates[choice["index"]].feed(choice["delta"].get("content") or ""))
+
+                    if len(questions) == num_questions:
+                        ended = False
+                        break
+            except TRANSIENT_ERRORS:
+                # the drafts' last questions may be cut off, so they're neither closed nor converted
+                ended = False
+                interrupted = True
+            finally:
+                await completion.aclose()
+
+            budget.spend(prompt_tokens + sum(count_tokens((candidate.text for candidate in candidates), profile.encoding)))
+        else:
+            for index, choice in enumerate(completion["choices"]):
+                follow(index, candidates[index].feed(choice["message"]["content"]))
+
+        generated = budget.tokens
+
         print("Post processing shard...")
-        processed = postprocess_with_gpt(
-            completion["choices"][0]["message"]["content"],
-            prompt.prompt_type,
-            num_questions
-        )
+        for index, candidate in enumerate(candidates):
+            if ended:
+                follow(index, candidate.close())
 
-        if processed:
-            return processed
+        # convert a short draft with the JSON model, or the first candidate when none could be parsed
+        # converted questions repeating ones already kept are skipped
+        converted = {}
+        if ended and len(questions) < num_questions:
+            index = followed or 0
+            processed = await convert_draft(candidates[index].text, prompt.prompt_type, missing, budget)
+            converted[index] = len(processed) == missing
+            keep(processed)
+
+        for index, candidate in enumerate(candidates):
+            if not candidate.text:
+                continue
+
+            usable = converted.get(index, len(candidate.questions) >= missing)
+            budget.record_draft(candidate.text, prompt.prompt_type, missing, converted=usable)
+
+            # a draft only fails once conversion can't use it either, short drafts left unconverted aren't counted
+            if index in converted or usable:
+                failure_rates.record(prompt.prompt_type, not usable)
+
+            if index != followed:
+                budget.bank(shard, candidate.questions)
+
+        # fill a short batch from the reserve before generating more
+        keep(budget.withdraw(shard, num_questions - len(questions), exclude={ question["question"] for question in questions }))
+
+        if len(questions) == num_questions:
+            return questions
+
+        # back off before asking again for the questions an interrupted stream didn't finish
+        # otherwise conversions already counted their own waste, regenerate the draft
+        if interrupted:
+            budget.retries += 1
+            await asyncio.sleep(budget.backoff(attempt))
+        elif len(questions) == num_questions - missing:
+            budget.discard(tokens, generated)
+
+        if questions:
+            budget.top_ups += 1
+
+    raise RetryBudgetExceededError("We couldn't generate well-formatted questions for your content. Please try again.")
 
 
-# divide quiz questions evenly by shard
-# don't allow more than five questions per shard
-def divide_questions(shards, num_questions, custom_prompt, prompt_type):
-    # find questions per shard and remainder after division
-    remainder = num_questions % len(shards)
-    questions_per_shard = num_questions // len(shards)
+def run_gpt3(shard, num_questions, custom_prompt, prompt_type, model=GPT_MODEL, budget=None):
+    return get_executor().run(run_gpt3_async, shard, num_questions, custom_prompt, prompt_type, model, budget)
 
+
+# divide quiz questions evenly by shard, earlier shards taking the remainder
+# jobs start with their shard's index, followed by `run_gpt3_async`'s arguments,
+# so shards with identical text (eg. repeated boilerplate) are still told apart
+def divide_questions(shards, num_questions, custom_prompt, prompt_type, model=GPT_MODEL):
     jobs = []
 
-    # handle case where more than five questions per shard
-    if questions_per_shard > NUM_QUESTIONS or (questions_per_shard == NUM_QUESTIONS and remainder > 0):
-        remaining_questions = num_questions - NUM_QUESTIONS * len(shards)
+    for index, shard in enumerate(shards):
+        shard_questions = num_questions // len(shards) + (index < num_questions % len(shards))
 
-        jobs.extend(divide_questions(shards, remaining_questions, custom_prompt, prompt_type))
-        jobs.extend(divide_questions(shards, num_questions - remaining_questions, custom_prompt, prompt_type))
-    # handle normal case (max questions per shard <= 5)
-    else:
-        for index, shard in enumerate(shards):
-            if index < remainder:
-                jobs.append((shard, questions_per_shard + 1, custom_prompt, prompt_type))
-            elif questions_per_shard > 0:
-                jobs.append((shard, questions_per_shard, custom_prompt, prompt_type))
+        if shard_questions > 0:
+            jobs.append((index, shard, shard_questions, custom_prompt, prompt_type, model))
 
     return jobs
 
-def complete(file_content, parser, num_questions, custom_prompt=None, prompt_type=PromptType.MCQ):
+
+# most questions for `shard` that fit in a single call's output budget
+# never fewer than the profile's questions per call, which shards are sized to allow
+def shard_capacity(shard, custom_prompt, prompt_type, model=GPT_MODEL, output_format=None):
+    profile = MODEL_PROFILES[model]
+    prompt = Prompt(custom_prompt=custom_prompt, prompt_type=prompt_type, num_questions=profile.questions_per_call, output_format=output_format)\
+        .add_system_prompt()\
+        .add_message(role="user", content=shard)
+
+    # drafts that fail to parse must still fit `JSON_MODEL`'s context to be converted
+    output_size = profile.context_window - count_message_tokens(prompt.messages, profile.encoding)
+    capacity = min(output_size // profile.question_size, conversion_capacity(prompt_type))
+
+    return max(profile.questions_per_call, capacity)
+
+
+# plan the calls generating `num_questions` from `shards`
+# each shard's questions are merged into as few calls as its output budget allows, so its content is sent once where possible
+def plan_jobs(shards, num_questions, custom_prompt, prompt_type, model=GPT_MODEL, output_format=None):
+    jobs = []
+
+    for index, shard, shard_questions, *job in divide_questions(shards, num_questions, custom_prompt, prompt_type, model):
+        calls = math.ceil(shard_questions / shard_capacity(shard, custom_prompt, prompt_type, model, output_format))
+
+        for call in range(calls):
+            jobs.append((index, shard, shard_questions // calls + (call < shard_questions % calls), *job))
+
+    return jobs
+
+async def complete_async(file_content, parser, num_questions, custom_prompt=None, prompt_type=PromptType.MCQ, model=GPT_MODEL, concurrency=COMPLETION_CONCURRENCY, budget=None, output_format=None):
+    components = parser(file_content)
+    shards = shard_chapter(components, model)
+
+    return await complete_shards_async(shards, num_questions, custom_prompt, prompt_type, model, concurrency, budget, output_format=output_format)
+
+
+def complete(file_content, parser, num_questions, custom_prompt=None, prompt_type=PromptType.MCQ, model=GPT_MODEL, budget=None, output_format=None):
     components = parser(file_content)
-    shards = shard_chapter(components)
-    jobs = divide_questions(shards, num_questions, custom_prompt, prompt_type)
+    shards = shard_chapter(components, model)
 
+    return complete_shards(shards, num_questions, custom_prompt, prompt_type, model, budget, output_format=output_format)
+
+
+# jobs generating questions for each shard
+def shard_jobs(shards, num_questions, custom_prompt=None, prompt_type=PromptType.MCQ, model=GPT_MODEL, output_format=None):
     # limit content size to three shards
     if len(shards) > 3:
         raise QuizicistError("Your uploaded content is too long. Please shorten the prompt and try again.")
 
-    # parallelize GPT-3 calls
-    with Pool(len(jobs)) as pool:
-        return pool.starmap(run_gpt3, jobs)
+    return plan_jobs(shards, num_questions, custom_prompt, prompt_type, model, output_format)
 
 
-def add_answer_choices(file_content, parser, question):
-    components = parser(file_content)
-    shard = shard_chapter(components)[question.shard]
+# pass a job's questions to `on_question` along with the index of the job's shard
+def shard_callback(job, on_question):
+    if on_question is None:
+        return None
+
+    return functools.partial(on_question, job[0])
+
+
+# questions from each job, gathered into a list per shard in shard order
+def questions_by_shard(shards, jobs, results):
+    questions = [[] for _ in shards]
+
+    for (index, *_), result in zip(jobs, results):
+        questions[index].extend(result)
+
+    return questions
+
+
+# generate questions from content that has already been parsed and sharded
+# runs every shard job as a coroutine on the caller's event loop, with at most `concurrency` jobs in flight
+# returns the questions generated for each shard
+# jobs share `budget`, which records the upload's retries and token use
+# `on_question` is called with each question's shard index and the question as soon as it's parsed
+# questions are generated in `output_format`, or the prompt type's default format
+async def complete_shards_async(shards, num_questions, custom_prompt=None, prompt_type=PromptType.MCQ, model=GPT_MODEL, concurrency=COMPLETION_CONCURRENCY, budget=None, on_question=None, output_format=None):
+    jobs = shard_jobs(shards, num_questions, custom_prompt, prompt_type, model, output_format)
+    semaphore = asyncio.Semaphore(concurrency)
+    budget = budget or RetryBudget()
+
+    async def run_job(job):
+        async with semaphore:
+            return await run_gpt3_async(*job[1:], budget, output_format, shard_callback(job, on_question))
+
+    async with api_session():
+        return questions_by_shard(shards, jobs, await asyncio.gather(*map(run_job, jobs)))
+
+
+# synchronous variant, sharing the process-wide executor's limits with other uploads
+# `on_question` is called from the executor's thread
+def complete_shards(shards, num_questions, custom_prompt=None, prompt_type=PromptType.MCQ, model=GPT_MODEL, budget=None, on_question=None, output_format=None):
+    questions = dict(complete_shards_iter(shards, num_questions, custom_prompt, prompt_type, model, budget, on_question, output_format))
+    return [questions[index] for index in range(len(shards))]
+
+
+# like `complete_shards`, but yields (shard index, questions) as soon as each shard's jobs have all finished
+# so callers can save and show a shard's questions without waiting for the slowest shard
+def complete_shards_iter(shards, num_questions, custom_prompt=None, prompt_type=PromptType.MCQ, model=GPT_MODEL, budget=None, on_question=None, output_format=None):
+    jobs = shard_jobs(shards, num_questions, custom_prompt, prompt_type, model, output_format)
+    budget = budget or RetryBudget()
+
+    # jobs and questions still outstanding for each shard, in job order
+    remaining = { index: 0 for index in range(len(shards)) }
+    results = {}
+    for job in jobs:
+        remaining[job[0]] += 1
+
+    # shards without any jobs are complete before generation starts
+    for index, count in remaining.items():
+        if count == 0:
+            yield index, []
+
+    calls = [(*job[1:], budget, output_format, shard_callback(job, on_question)) for job in jobs]
+    for job_index, result in get_executor().as_completed(run_gpt3_async, calls):
+        shard = jobs[job_index][0]
+        results[job_index] = result
+        remaining[shard] -= 1
+
+        if remaining[shard] == 0:
+            yield shard, [
+                question
+                for index, job in enumerate(jobs) if job[0] == shard
+                for question in results[index]
+            ]
+
+
+async def add_answer_choices_async(shards, question, budget=None):
+    budget = budget or RetryBudget()
+    shard = shards[question.shard]
 
     incomplete_question = f"""
 Question: {question.question}
@@ -122,13 +389,18 @@ Correct answer:
         .add_message(role="user", content=shard)\
         .add_message(role="user", content=incomplete_question)
 
-    # TODO: clean up this loop or consolidate parsing into a single function
-    while True:
+    profile = MODEL_PROFILES[GPT_MODEL]
+    prompt_tokens = count_message_tokens(prompt.messages, profile.encoding)
+
+    for _ in range(budget.policy.max_attempts):
+        tokens = budget.tokens
+
         print("Running completion for custom question...")
-        completion = openai.ChatCompletion.create(
+        completion = await budget.create(
+            prompt_tokens,
             model=GPT_MODEL,
             messages=prompt.messages,
-            max_tokens=ESTIMATED_QUESTION_SIZE,
+            max_tokens=profile.question_size,
             temperature=0.8,
         )
                 
@@ -139,3 +411,10 @@ Correct answer:
             return processed
 
         print(f"Failed to parse the following:\n{completion}")
+        budget.discard(tokens)
+
+    raise RetryBudgetExceededError("We couldn't generate answer choices for your question. Please try again.")
+
+
+def add_answer_choices(shards, question, budget=None):
+    return get_executor().run(add_answer_choices_async, shards, question, budget)
@@ -1,4 +1,5 @@
 import enum
+from dataclasses import dataclass
 
 
 # gpt model to use for generating questions
@@ -9,6 +10,7 @@ JSON_MODEL = "gpt-3.5-turbo"
 
 # markdown element types valid at the top level
 TOP_LEVEL_COMPONENTS = [
+    "Heading",
     "Paragraph",
     "CodeFence",
     "List"
@@ -17,14 +19,33 @@ TOP_LEVEL_COMPONENTS = [
 # number of questions to generate per shard
 NUM_QUESTIONS = 5
 
-# maximum tokens allowed in DaVinci-2 model prompt
-MAX_MODEL_PROMPT_SIZE = 4000
-
 # estimated number of tokens generated from a single MCQ
 ESTIMATED_QUESTION_SIZE = 175
 
-# assuming generating 5 questions per shard, largest context possible
-MAX_CONTEXT_SIZE = MAX_MODEL_PROMPT_SIZE - NUM_QUESTIONS * ESTIMATED_QUESTION_SIZE
+# tokens reserved in each shard's budget for a user-provided custom prompt
+CUSTOM_PROMPT_SIZE = 250
+
+# context and tokenizer information for a chat model
+@dataclass(frozen=True)
+class ModelProfile:
+    # maximum number of prompt and completion tokens
+    context_window: int
+
+    # BPE encoding used by the model's tokenizer
+    encoding: str
+
+    # estimated number of tokens generated for a single question
+    question_size: int = ESTIMATED_QUESTION_SIZE
+
+    # most questions requested from the model in a single call
+    questions_per_call: int = NUM_QUESTIONS
+
+MODEL_PROFILES = {
+    "gpt-4": ModelProfile(context_window=8192, encoding="cl100k_base"),
+    "gpt-4-32k": ModelProfile(context_window=32768, encoding="cl100k_base"),
+    "gpt-3.5-turbo": ModelProfile(context_window=4096, encoding="cl100k_base"),
+    "gpt-3.5-turbo-16k": ModelProfile(context_window=16384, encoding="cl100k_base"),
+}
 
 # feedback options for answer choices
 class FeedbackTypes(enum.IntEnum):
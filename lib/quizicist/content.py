@@ -0,0 +1,69 @@
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+from .completion import chapter_tokens, shard_chapter
+from .consts import GPT_MODEL
+from .document import Document
+
+# bump when parser or sharder output changes, invalidating cached content
+PARSER_VERSION = 3
+
+# words compared when matching text to shards
+WORD = re.compile(r"\w+")
+
+# directory for parsed content, shared by all processes on a host
+CACHE_DIR = os.getenv("QUIZICIST_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "quizicist-parsed")
+
+
+# cache key for content parsed and sharded with a given parser and model
+def content_hash(content: str, parser, model=GPT_MODEL) -> str:
+    digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    return f"{parser.__name__}-{model}-v{PARSER_VERSION}-{digest}"
+
+
+# parse and shard content, reusing results stored for identical content
+def parse_content(file_content, parser, model=GPT_MODEL, cache_dir=CACHE_DIR):
+    content = file_content if isinstance(file_content, str) else file_content.read()
+    cache_path = os.path.join(cache_dir, content_hash(content, parser, model) + ".json")
+
+    try:
+        with open(cache_path) as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        pass
+
+    components = parser(io.StringIO(content))
+    document = Document.from_components(components)
+    parsed = {
+        "components": components,
+        "shards": shard_chapter(document, model),
+        "tokens": chapter_tokens(document),
+    }
+
+    # write atomically so concurrent workers never read a partial file
+    os.makedirs(cache_dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", dir=cache_dir, suffix=".tmp", delete=False) as f:
+        json.dump(parsed, f)
+
+    os.replace(f.name, cache_path)
+    return parsed
+
+
+# number of words each text shares with each shard
+def shard_overlaps(shards, texts):
+    shard_words = [set(WORD.findall(shard.lower())) for shard in shards]
+    overlaps = []
+
+    for text in texts:
+        words = set(WORD.findall(text.lower()))
+        overlaps.append([len(words & shard) for shard in shard_words])
+
+    return overlaps
+
+
+# index of the shard sharing the most words with each text, eg. to match questions to content sharded again
+def match_shards(shards, texts):
+    return [overlaps.index(max(overlaps)) for overlaps in shard_overlaps(shards, texts)]
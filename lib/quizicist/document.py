@@ -0,0 +1,168 @@
+from __future__ import annotations
+from collections import deque
+from typing import Iterable, Iterator, List, Tuple
+import numpy as np
+
+# cost of starting a shard at a component, by whether it or its predecessor is a heading
+HEADING_CUT_COST = 0
+BODY_CUT_COST = 1
+ORPHAN_HEADING_CUT_COST = 2
+
+
+# parsed content stored as one text buffer with per-component offsets and token counts
+class Document:
+    text: str
+    offsets: np.ndarray
+    tokens: np.ndarray
+    headings: np.ndarray
+
+    def __init__(self, text: str, offsets: np.ndarray, tokens: np.ndarray, headings: np.ndarray = None):
+        self.text = text
+        self.offsets = offsets
+        self.tokens = tokens
+        self.headings = np.zeros(len(tokens), dtype=bool) if headings is None else headings
+
+        # prefix sums of token counts, `cumulative_tokens[i]` is the size of components [0, i)
+        self.cumulative_tokens = np.zeros(len(tokens) + 1, dtype=np.int64)
+        np.cumsum(tokens, out=self.cumulative_tokens[1:])
+
+    # build from {"text", "tokens"} components, joining text once
+    @classmethod
+    def from_components(cls, components: Iterable[dict]) -> Document:
+        if isinstance(components, Document):
+            return components
+
+        texts = []
+        tokens = []
+        headings = []
+
+        for component in components:
+            texts.append(component["text"])
+            tokens.append(component["tokens"])
+            headings.append(component.get("heading", False))
+
+        offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter(map(len, texts), dtype=np.int64, count=len(texts)), out=offsets[1:])
+
+        return cls("".join(texts), offsets, np.array(tokens, dtype=np.int64), np.array(headings, dtype=bool))
+
+    @property
+    def total_tokens(self) -> int:
+        return int(self.cumulative_tokens[-1])
+
+    # tokens in components [start, end)
+    def span_tokens(self, start: int, end: int) -> int:
+        return int(self.cumulative_tokens[end] - self.cumulative_tokens[start])
+
+    # text of components [start, end), sliced once from the shared buffer
+    def span_text(self, start: int, end: int) -> str:
+        return self.text[self.offsets[start]:self.offsets[end]]
+
+    # dict view of a single component, matching the parsers' list API
+    def __getitem__(self, index: int) -> dict:
+        if index < 0:
+            index += len(self)
+
+        if not 0 <= index < len(self):
+            raise IndexError("component index out of range")
+
+        return {
+            "text": self.span_text(index, index + 1),
+            "tokens": int(self.tokens[index]),
+            "heading": bool(self.headings[index]),
+        }
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def __iter__(self) -> Iterator[dict]:
+        return (self[index] for index in range(len(self)))
+
+    # greedy shard boundaries, filling each shard up to `max_tokens`
+    def shard_bounds(self, max_tokens: int) -> List[Tuple[int, int]]:
+        bounds = []
+        start = 0
+
+        while start < len(self):
+            # first component that would push the shard past its maximum size
+            end = np.searchsorted(self.cumulative_tokens, self.cumulative_tokens[start] + max_tokens, side="right") - 1
+
+            # every shard holds at least one component
+            end = max(int(end), start + 1)
+            bounds.append((start, end))
+            start = end
+
+        return bounds
+
+    # cost of a shard boundary before component `index`, cheapest at section headings
+    def cut_cost(self, index: int) -> int:
+        if index == 0 or self.headings[index]:
+            return HEADING_CUT_COST
+
+        if self.headings[index - 1]:
+            return ORPHAN_HEADING_CUT_COST
+
+        return BODY_CUT_COST
+
+    # fewest shards of at most `max_tokens`, with the smallest possible largest shard
+    # shards may grow by `slack` past that size to end at a section boundary
+    def partition(self, max_tokens: int, slack: float = 0) -> List[Tuple[int, int]]:
+        if len(self) == 0:
+            return []
+
+        # components larger than the maximum can only be placed in a shard of their own
+        largest = int(self.tokens.max())
+        max_tokens = max(max_tokens, largest)
+        num_shards = len(self.shard_bounds(max_tokens))
+
+        # binary search for the smallest shard size that still needs only `num_shards` shards
+        low, high = largest, max_tokens
+        while low < high:
+            size = (low + high) // 2
+
+            if len(self.shard_bounds(size)) <= num_shards:
+                high = size
+            else:
+                low = size + 1
+
+        return self.structured_bounds(min(max_tokens, int(low * (1 + slack))))
+
+    # split into shards of at most `max_tokens`, using the fewest shards and then the cheapest cuts
+    # linear partition DP, with a sliding window minimum over each shard's possible starts
+    def structured_bounds(self, max_tokens: int) -> List[Tuple[int, int]]:
+        cumulative = self.cumulative_tokens.tolist()
+
+        # best (shards, cut cost) score splitting components [0, end), and where its last shard starts
+        scores = [(0, 0)] * (len(self) + 1)
+        starts = [0] * (len(self) + 1)
+        window = deque()
+
+        for end in range(1, len(self) + 1):
+            # a shard may start right before `end`, keep window scores increasing
+            start = end - 1
+            shards, cost = scores[start]
+            score = (shards + 1, cost + self.cut_cost(start))
+
+            while window and window[-1][1] >= score:
+                window.pop()
+
+            window.append((start, score))
+
+            # drop starts whose shard would grow past the maximum
+            while cumulative[end] - cumulative[window[0][0]] > max_tokens:
+                window.popleft()
+
+            starts[end], scores[end] = window[0]
+
+        # walk back from the final shard's end to recover boundaries
+        bounds = []
+        end = len(self)
+
+        while end > 0:
+            bounds.append((starts[end], end))
+            end = starts[end]
+
+        return bounds[::-1]
+
+    def shards(self, bounds: List[Tuple[int, int]]) -> List[str]:
+        return [self.span_text(start, end) for start, end in bounds]
@@ -1,3 +1,8 @@
 # custom exception class for API errors
 class QuizicistError(Exception):
     pass
+
+
+# raised when the process's LLM executor has no room for more jobs
+class ExecutorSaturatedError(QuizicistError):
+    pass
@@ -0,0 +1,153 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import Future, as_completed
+from typing import Iterator, List, Tuple
+import aiohttp
+import openai
+from .errors import ExecutorSaturatedError
+
+# most LLM jobs running at once in a process
+MAX_IN_FLIGHT = int(os.getenv("QUIZICIST_MAX_IN_FLIGHT", "32"))
+
+# most LLM jobs waiting for a free slot before new work is rejected
+MAX_QUEUED = int(os.getenv("QUIZICIST_MAX_QUEUED", "64"))
+
+
+# long-lived event loop thread shared by every LLM call in the process
+# jobs past `max_in_flight` wait in a queue, jobs past the queue's capacity are rejected
+class Executor:
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, max_queued=MAX_QUEUED):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+
+        # gauges, guarded by `lock` since jobs are submitted from request threads
+        self.queued = 0
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+        self.loop = asyncio.new_event_loop()
+        self.slots = asyncio.Semaphore(max_in_flight)
+        self.session = None
+
+        self.thread = threading.Thread(target=self.loop.run_forever, name="quizicist-executor", daemon=True)
+        self.thread.start()
+
+    def gauges(self):
+        with self.lock:
+            return {
+                "queued": self.queued,
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "max_queued": self.max_queued,
+            }
+
+    # raise if there's no room for `count` more jobs, without claiming any
+    def check_capacity(self, count=1):
+        with self.lock:
+            self.check_room(count)
+
+    # claim room for `count` jobs, all or nothing
+    def reserve(self, count):
+        with self.lock:
+            self.check_room(count)
+            self.queued += count
+
+    # callers hold `lock`
+    def check_room(self, count):
+        if self.queued + self.in_flight + count > self.max_in_flight + self.max_queued:
+            raise ExecutorSaturatedError("We're currently experiencing high demand. Please wait a few minutes and try again.")
+
+    async def run_job(self, function, args, job):
+        async with self.slots:
+            with self.lock:
+                # a job cancelled while taking its slot has already left the queue
+                if not job["started"]:
+                    job["started"] = True
+                    self.queued -= 1
+
+                self.in_flight += 1
+
+            try:
+                # API calls from every job share one HTTP session
+                if self.session is None:
+                    self.session = aiohttp.ClientSession()
+
+                openai.aiosession.set(self.session)
+                return await function(*args)
+            finally:
+                with self.lock:
+                    self.in_flight -= 1
+
+    # schedule a job that already has room reserved
+    def schedule(self, function, args) -> Future:
+        job = { "started": False }
+        future = asyncio.run_coroutine_threadsafe(self.run_job(function, args, job), self.loop)
+
+        # jobs cancelled or failed before getting a slot (possibly before running at all) give back their place in the queue
+        def release(_):
+            with self.lock:
+                if not job["started"]:
+                    job["started"] = True
+                    self.queued -= 1
+
+        future.add_done_callback(release)
+        return future
+
+    # schedule `function(*args)` on the executor's loop
+    def submit(self, function, *args) -> Future:
+        self.reserve(1)
+        return self.schedule(function, args)
+
+    # run `function(*args)` and wait for its result
+    def run(self, function, *args):
+        return self.submit(function, *args).result()
+
+    # run `function` over argument tuples, returning results in order
+    def starmap(self, function, jobs) -> List:
+        jobs = list(jobs)
+        self.reserve(len(jobs))
+
+        futures = [self.schedule(function, job) for job in jobs]
+
+        try:
+            return [future.result() for future in futures]
+        except BaseException:
+            for future in futures:
+                future.cancel()
+
+            raise
+
+    # run `function` over argument tuples, yielding (index, result) pairs as jobs finish
+    def as_completed(self, function, jobs) -> Iterator[Tuple[int, object]]:
+        jobs = list(jobs)
+        self.reserve(len(jobs))
+
+        futures = { self.schedule(function, job): index for index, job in enumerate(jobs) }
+
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            # cancel jobs still running when a job fails or the caller stops reading
+            for future in futures:
+                future.cancel()
+
+
+# executor for the current process, created on first use
+# forked processes (eg. preloaded gunicorn workers) start their own
+executor = None
+executor_pid = None
+executor_lock = threading.Lock()
+
+
+def get_executor() -> Executor:
+    global executor, executor_pid
+
+    if executor_pid != os.getpid():
+        with executor_lock:
+            if executor_pid != os.getpid():
+                executor = Executor()
+                executor_pid = os.getpid()
+
+    return executor
@@ -0,0 +1,154 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+# shared storage for rate limit buckets, eg. "memcached://localhost:11211"
+RATELIMIT_STORAGE_URI = os.getenv("QUIZICIST_RATELIMIT_STORAGE_URI", "memory://")
+
+# prefix of bucket keys, so governed processes share buckets without clashing with other users of the storage
+KEY_PREFIX = "quizicist-governor"
+
+# extra wait added when a call must wait for capacity, spreading out callers waiting on the same bucket
+MAX_JITTER = 0.25
+
+# check-and-set attempts on a bucket before the caller backs off, so contended buckets can't spin forever
+CAS_ATTEMPTS = 5
+
+
+# account limits for a single model, applied across every process sharing the storage
+@dataclass(frozen=True)
+class RateLimit:
+    requests_per_minute: int
+    tokens_per_minute: int
+
+
+# buckets held in this process's memory, for local development or a single worker
+class MemoryStorage:
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+
+    # atomically replace a key's value with `function(value)`, returning the function's result
+    def update(self, key, function):
+        with self.lock:
+            self.values[key], result = function(self.values.get(key))
+            return result
+
+
+# raised when a bucket keeps changing under an update, after `CAS_ATTEMPTS` tries
+class StorageContentionError(Exception):
+    pass
+
+
+# buckets in memcached, updated with check-and-set so concurrent workers never lose an update
+# calls block on the network, so the governor makes them outside of the event loop
+class MemcachedStorage:
+    def __init__(self, host, port, client=None):
+        if client is None:
+            from pymemcache.client.base import PooledClient
+
+            client = PooledClient((host, port), default_noreply=False)
+
+        self.client = client
+
+    def update(self, key, function):
+        for _ in range(CAS_ATTEMPTS):
+            encoded, cas = self.client.gets(key)
+            value, result = function(json.loads(encoded) if encoded else None)
+
+            if encoded is None:
+                stored = self.client.add(key, json.dumps(value))
+            else:
+                stored = self.client.cas(key, json.dumps(value), cas)
+
+            # not stored when another worker changed the key since it was read, retry with its value
+            if stored:
+                return result
+
+        raise StorageContentionError(f"Rate limit bucket {key} changed on every update")
+
+
+def storage_from_uri(uri):
+    parsed = urlparse(uri)
+
+    if parsed.scheme == "memory":
+        return MemoryStorage()
+
+    if parsed.scheme == "memcached":
+        return MemcachedStorage(parsed.hostname or "localhost", parsed.port or 11211)
+
+    raise ValueError(f"Unsupported rate limit storage: {uri}")
+
+
+# refill a model's request and token buckets, taking one request and `tokens` tokens if both have room
+# returns the new bucket state and the number of seconds to wait before retrying (0 when admitted)
+def take(state, limit: RateLimit, tokens: int, now: float):
+    # calls larger than the bucket wait for a full bucket instead of waiting forever
+    tokens = min(tokens, limit.tokens_per_minute)
+
+    if state is None:
+        state = { "requests": limit.requests_per_minute, "tokens": limit.tokens_per_minute, "updated": now }
+
+    # buckets refill continuously, reaching their limit after a minute
+    elapsed = max(now - state["updated"], 0)
+    requests = min(limit.requests_per_minute, state["requests"] + elapsed * limit.requests_per_minute / 60)
+    available = min(limit.tokens_per_minute, state["tokens"] + elapsed * limit.tokens_per_minute / 60)
+
+    if requests >= 1 and available >= tokens:
+        return { "requests": requests - 1, "tokens": available - tokens, "updated": now }, 0
+
+    wait = max(
+        (1 - requests) * 60 / limit.requests_per_minute,
+        (tokens - available) * 60 / limit.tokens_per_minute,
+    )
+
+    return { "requests": requests, "tokens": available, "updated": now }, wait
+
+
+# admits OpenAI calls against per-model requests and tokens per minute budgets
+class RateGovernor:
+    def __init__(self, storage, limits: Dict[str, RateLimit]):
+        self.storage = storage
+        self.limits = limits
+
+    # take capacity for a call, returning seconds to wait if there isn't enough
+    def try_acquire(self, model, tokens) -> float:
+        limit = self.limits.get(model)
+        if limit is None:
+            return 0
+
+        try:
+            return self.storage.update(
+                f"{KEY_PREFIX}-{model}",
+                lambda state: take(state, limit, tokens, time.time())
+            )
+        except StorageContentionError:
+            # other workers are updating the bucket, try again once they've spread out
+            return MAX_JITTER
+
+    # wait until the call fits in the model's budgets
+    # storage is updated from a worker thread, so a slow memcached never stalls other calls on the loop
+    async def acquire(self, model, tokens):
+        while (wait := await asyncio.to_thread(self.try_acquire, model, tokens)) > 0:
+            await asyncio.sleep(wait + random.uniform(0, MAX_JITTER))
+
+
+# governor shared by all calls in the process, unset until configured
+governor: Optional[RateGovernor] = None
+
+
+def configure_governor(limits: Dict[str, RateLimit], storage_uri=RATELIMIT_STORAGE_URI):
+    global governor
+    governor = RateGovernor(storage_from_uri(storage_uri), limits)
+
+
+# wait for capacity for a call to `model` using about `tokens` prompt and completion tokens
+async def admit(model, tokens):
+    if governor is not None:
+        await governor.acquire(model, tokens)
@@ -0,0 +1,122 @@
+import functools
+import os
+import re
+from typing import Dict, Optional, Tuple
+from dotenv import load_dotenv
+
+# required to resolve code listings
+load_dotenv()
+BOOK_PATH = os.getenv("RUST_BOOK_PATH") or ""
+BOOK_DIR = os.path.join(BOOK_PATH, "src")
+
+# mdBook include directive, eg. {{#rustdoc_include ../listings/main.rs:anchor}}
+INCLUDE_PATTERN = re.compile(r"{{#(\w+)\s+([^}\s]+)\s*}}")
+
+# anchor comments marking named sections of a listing
+ANCHOR_START = re.compile(r"ANCHOR:\s*([\w-]+)")
+ANCHOR_END = re.compile(r"ANCHOR_END:\s*([\w-]+)")
+
+# number of (path, mtime) listings kept in memory
+LISTING_CACHE_SIZE = 512
+
+# listings read ahead of time by `preload_book`, keyed by absolute path
+preloaded_listings: Dict[str, Tuple[str, ...]] = {}
+
+
+@functools.lru_cache(maxsize=LISTING_CACHE_SIZE)
+def read_listing(path: str, mtime: int) -> Tuple[str, ...]:
+    with open(path) as f:
+        return tuple(f.read().splitlines(keepends=True))
+
+
+# lines of a listing, None if the listing can't be read
+def load_listing(path: str) -> Optional[Tuple[str, ...]]:
+    path = os.path.abspath(path)
+
+    if path in preloaded_listings:
+        return preloaded_listings[path]
+
+    # modification time invalidates cached listings that changed on disk
+    try:
+        return read_listing(path, os.stat(path).st_mtime_ns)
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+# read every text file under the book's root, so bulk processing touches each listing once
+def preload_book(book_path=BOOK_PATH):
+    for directory, subdirectories, filenames in os.walk(book_path):
+        # skip build output and version control
+        subdirectories[:] = [name for name in subdirectories if name not in ["target", "book", ".git"]]
+
+        for filename in filenames:
+            path = os.path.abspath(os.path.join(directory, filename))
+
+            try:
+                with open(path) as f:
+                    preloaded_listings[path] = tuple(f.read().splitlines(keepends=True))
+            except (OSError, UnicodeDecodeError):
+                continue
+
+
+def is_anchor_line(line: str) -> bool:
+    return bool(ANCHOR_START.search(line) or ANCHOR_END.search(line))
+
+
+# lines between `ANCHOR: name` and `ANCHOR_END: name`, excluding anchor comments
+def anchored_lines(lines, anchor: str):
+    selected = []
+    inside = False
+
+    for line in lines:
+        end = ANCHOR_END.search(line)
+        start = ANCHOR_START.search(line)
+
+        if end and end.group(1) == anchor:
+            if inside:
+                break
+        elif start and start.group(1) == anchor:
+            inside = True
+        elif inside and not is_anchor_line(line):
+            selected.append(line)
+
+    return selected
+
+
+# apply mdBook's selector syntax: `:anchor`, `:line`, `:start:`, `::end`, `:start:end`
+def select_lines(lines, selector: str):
+    parts = selector.split(":")
+
+    if len(parts) == 1 and not parts[0].isdigit():
+        return anchored_lines(lines, parts[0])
+
+    # line numbers are 1-based and inclusive
+    if len(parts) == 1:
+        start = int(parts[0]) - 1
+        end = start + 1
+    else:
+        start = int(parts[0]) - 1 if parts[0] else 0
+        end = int(parts[1]) if parts[1] else None
+
+    return [line for line in lines[max(start, 0):end] if not is_anchor_line(line)]
+
+
+# load file content from an mdBook include directive, relative to the book's src directory
+def resolve_include(directive: str, book_dir=BOOK_DIR) -> str:
+    match = INCLUDE_PATTERN.match(directive)
+    if not match or "include" not in match.group(1):
+        return ""
+
+    listing_path, _, selector = match.group(2).partition(":")
+    lines = load_listing(os.path.join(book_dir, listing_path))
+
+    # handle files not found in Rust Book listings
+    if lines is None:
+        return ""
+
+    if selector:
+        lines = select_lines(lines, selector)
+    else:
+        lines = [line for line in lines if not is_anchor_line(line)]
+
+    return "".join(lines)
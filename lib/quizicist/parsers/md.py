@@ -1,22 +1,11 @@
-from dotenv import load_dotenv
-import os
-import json
 import re
+from itertools import tee
 import mistletoe
 from mistletoe.ast_renderer import ASTRenderer
-from bs4 import BeautifulSoup
-from transformers import GPT2Tokenizer
 from ..consts import TOP_LEVEL_COMPONENTS
-
-# required to resolve code listings
-load_dotenv()
-BOOK_DIR = os.path.join(os.getenv("RUST_BOOK_PATH") or "", "src")
-
-tokenizer = GPT2Tokenizer.from_pretrained("gpt2")
-
-# clean tags from html within markdown, returning only text
-def clean_html(text):
-    return BeautifulSoup(text, "lxml").text
+from ..tokens import count_components
+from . import includes
+from .strip import strip_html
 
 
 # load file content from included listings
@@ -35,70 +24,61 @@ def resolve_include(match):
         
         return ""
 
-    # get filename after "{{#<include type>" and remove trailing "}}"
-    filename = text.split(" ")
+    return includes.resolve_include(text)
 
-    if "include" not in filename[0]:
-        return ""
 
-    # remove anchor on path
-    split_filename = filename[1].split(":")
-    if len(split_filename) > 1:
-        listing_path = split_filename[0]
-    else:
-        listing_path = filename[1][:-2]
+# name of a mistletoe token's type, eg. "Paragraph"
+def token_type(token):
+    return token.__class__.__name__
 
-    listing_path = os.path.join(BOOK_DIR, listing_path)
 
-    # handle files not found in Rust Book listings
-    try:
-        with open(listing_path) as f:
-            return f.read()
-    except OSError:
-        return ""
-
-
-# recurse over MD AST, extracting raw text from inline elements
-def find_component_text(component):
-    text = []
-
-    for child in component["children"]:
-        if child["type"] == "RawText":
+# recurse over MD AST, collecting raw text from inline elements
+def collect_component_text(component, text):
+    for child in component.children:
+        if token_type(child) == "RawText":
             # add content to component text, replacing includes with relevant content
-            text.append(re.sub(r'{{(.*?)}}', resolve_include, child["content"]))
+            text.append(re.sub(r'{{(.*?)}}', resolve_include, child.content))
 
-        elif child["type"] == "LineBreak":
+        elif token_type(child) == "LineBreak":
             text.append(" ")
 
-        elif "children" in child:
-            text.append(find_component_text(child))
+        elif hasattr(child, "children"):
+            collect_component_text(child, text)
 
-    if component["type"] in TOP_LEVEL_COMPONENTS:
+    if token_type(component) in TOP_LEVEL_COMPONENTS:
         text.append("\n")
 
-    return clean_html("".join(text))
+
+# text of a top-level component, with html stripped in a single pass
+def find_component_text(component):
+    text = []
+    collect_component_text(component, text)
+
+    return strip_html("".join(text))
 
 
 # whether a top-level markdown child is valid for parsing
 def component_is_valid(component):
-    return component["type"] in TOP_LEVEL_COMPONENTS
+    return token_type(component) in TOP_LEVEL_COMPONENTS
 
 
-def extract_component_info(component):
-    text = find_component_text(component)
-    tokens = tokenizer(text)["input_ids"]
+# yield text and token count of each top-level component, walking mistletoe's tokens directly
+# mistletoe still parses the whole chapter up front, this only skips rendering its AST to JSON and loading it back
+def iter_md_components(chapter):
+    # parse with the AST renderer's token set, without serializing the AST
+    with ASTRenderer():
+        document = mistletoe.Document(chapter)
 
-    return {
-        "text": text,
-        "tokens": len(tokens),
-    }
+    valid_children, headings = tee(filter(component_is_valid, document.children))
+    texts = map(find_component_text, valid_children)
 
+    for component, child in zip(count_components(texts), headings):
+        # headings mark section boundaries, where shards are preferably split
+        component["heading"] = token_type(child) == "Heading"
 
-def md_parser(chapter):
-    # extract text and token count from parsed markdown
-    parsed = json.loads(mistletoe.markdown(chapter, ASTRenderer))
-    valid_children = filter(component_is_valid, parsed["children"])
-    children_info = map(extract_component_info, valid_children)
-    non_empty_components = list(filter(lambda c: c["tokens"] > 0, children_info))
+        if component["tokens"] > 0:
+            yield component
 
-    return non_empty_components
+
+def md_parser(chapter):
+    return list(iter_md_components(chapter))
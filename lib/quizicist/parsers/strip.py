@@ -0,0 +1,61 @@
+from html.parser import HTMLParser
+
+# whitespace skipped by lxml before the document's first content
+BLANKS = " \t\r\n"
+
+# tags that don't start document content
+HEAD_TAGS = ["html", "head", "title", "meta", "link", "base", "script", "style", "noscript"]
+
+# tags whose content is not rendered as text
+HIDDEN_TAGS = ["script", "style"]
+
+
+# streaming parser that keeps only rendered text, matching `BeautifulSoup(text, "lxml").text`
+class TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.text = []
+        self.hidden_depth = 0
+        self.in_content = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in HIDDEN_TAGS:
+            self.hidden_depth += 1
+
+        if tag not in HEAD_TAGS:
+            self.in_content = True
+
+    def handle_startendtag(self, tag, attrs):
+        if tag not in HEAD_TAGS:
+            self.in_content = True
+
+    def handle_endtag(self, tag):
+        if tag in HIDDEN_TAGS and self.hidden_depth > 0:
+            self.hidden_depth -= 1
+
+    def handle_data(self, data):
+        if self.hidden_depth > 0:
+            return
+
+        # like lxml, drop whitespace that precedes any content
+        if not self.in_content:
+            data = data.lstrip(BLANKS)
+            if not data:
+                return
+
+            self.in_content = True
+
+        self.text.append(data)
+
+
+# clean tags and entities from html within markdown, returning only text
+def strip_html(text):
+    # most components contain no markup
+    if "<" not in text and "&" not in text:
+        return text.lstrip(BLANKS)
+
+    extractor = TextExtractor()
+    extractor.feed(text)
+    extractor.close()
+
+    return "".join(extractor.text)
@@ -1,21 +1,22 @@
-from transformers import GPT2Tokenizer
+from ..tokens import count_components
 
-tokenizer = GPT2Tokenizer.from_pretrained("gpt2")
 
-def extract_chunk_info(chunk):
-    tokens = tokenizer(chunk)["input_ids"]
+# chunk text by newlines, reading one line at a time
+def iter_text_chunks(content):
+    line = "\n"
 
-    return {
-        "text": chunk,
-        "tokens": len(tokens),
-    }
+    for line in content:
+        yield line if line.endswith("\n") else line + "\n"
 
+    # content ending in a newline (or empty content) has a final empty chunk
+    if line.endswith("\n"):
+        yield "\n"
 
-def parse_text(content):
-    content = content.read()
 
-    # chunk text by newlines
-    delimiter = "\n"
-    chunks = [chunk + delimiter for chunk in content.split(delimiter)]
+# yield text and token count of each line, without reading the whole upload into memory
+def iter_text_components(content):
+    return count_components(iter_text_chunks(content))
+
 
-    return list(map(extract_chunk_info, chunks))
+def parse_text(content):
+    return list(iter_text_components(content))
@@ -1,9 +1,15 @@
+import asyncio
 import json
+import math
+import re
 import openai
 import os
 from dotenv import load_dotenv
-from .consts import ESTIMATED_QUESTION_SIZE, JSON_MODEL, NUM_QUESTIONS, FeedbackTypes
-from .prompt import Prompt, PromptType
+from .consts import JSON_MODEL, MODEL_PROFILES, NUM_QUESTIONS, FeedbackTypes
+from .executor import get_executor
+from .retry import RetryBudget
+from .prompt import OutputFormat, Prompt, PromptType
+from .tokens import count_message_tokens
 
 # set up openai
 load_dotenv()
@@ -29,7 +35,8 @@ Each object should contain keys for "question" and "follow-up".
 """,
 }
 
-def postprocess_with_gpt(output: str, prompt_type: PromptType, num_questions=NUM_QUESTIONS):
+# prompt converting generated questions to JSON
+def edit_mode_prompt(output: str, prompt_type: PromptType):
     prompt = Prompt(prompt_type=prompt_type)
 
     # add instruction to convert to JSON
@@ -44,68 +51,352 @@ def postprocess_with_gpt(output: str, prompt_type: PromptType, num_questions=NUM
         content=output
     )
 
-    completion = openai.ChatCompletion.create(
-        model=JSON_MODEL,
-        messages=prompt.messages, 
-        max_tokens=num_questions * ESTIMATED_QUESTION_SIZE,
-        temperature=0.8,
-    )
+    return prompt
+
+
+# fields every question of a prompt type must have
+REQUIRED_FIELDS = {
+    PromptType.MCQ: ["question", "correct", "incorrect"],
+    PromptType.OPEN_ENDED: ["question", "follow-up"],
+}
 
-    edited = completion["choices"][0]["message"]["content"]
+# markdown code fence models sometimes wrap JSON in
+JSON_FENCE = re.compile(r"^\s*```(?:json)?\s*\n(.*?)\n\s*```\s*$", re.DOTALL)
+
+
+# questions with their prompt type's fields, dropping malformed ones
+def valid_questions(parsed, prompt_type: PromptType = None):
+    if type(parsed) is not list:
+        return []
+
+    fields = REQUIRED_FIELDS.get(prompt_type, [])
+    return [question for question in parsed if type(question) is dict and all(question.get(field) for field in fields)]
+
+
+# decode questions converted to JSON, None if malformed
+def decode_edited(edited: str):
+    fenced = JSON_FENCE.match(edited)
+    if fenced:
+        edited = fenced.group(1)
 
-    # decode generated JSON
     try:
-        parsed = json.loads(edited)
+        return json.loads(edited)
     except json.JSONDecodeError:
-        return False
+        return None
+
+
+# decode questions converted to JSON, False if malformed
+# when `prompt_type` is given, each question must have the prompt type's fields
+def parse_edited(edited: str, num_questions=NUM_QUESTIONS, prompt_type: PromptType = None):
+    parsed = decode_edited(edited)
 
     # ensure gpt-3 generated correct number of questions questions
     if type(parsed) is not list or len(parsed) != num_questions:
         return False
 
+    if len(valid_questions(parsed, prompt_type)) != num_questions:
+        return False
+
     return parsed
 
 
-def postprocess_manual(answers: str, shard: int):
-    # grab question, if no correct answer return False
-    question, _, remaining = answers.partition("\nCorrect answer: ")
-    if question == "":
-        return False
+# most questions one `JSON_MODEL` call can convert, fitting the draft and its JSON in the model's context
+def conversion_capacity(prompt_type: PromptType):
+    profile = MODEL_PROFILES[JSON_MODEL]
+    prompt_tokens = count_message_tokens(edit_mode_prompt("", prompt_type).messages, profile.encoding)
+
+    return max(1, (profile.context_window - prompt_tokens) // (2 * profile.question_size))
+
+
+# split a template draft in two at a question label, None when it has fewer than two questions
+# returns both halves and the number of questions in the first
+def halve_draft(output: str):
+    starts = [match.start() for match in QUESTION_LABEL.finditer(output)]
+    if len(starts) < 2:
+        return None
+
+    middle = len(starts) // 2
+    return output[:starts[middle]], output[starts[middle]:], middle / len(starts)
+
+
+async def postprocess_with_gpt_async(output: str, prompt_type: PromptType, num_questions=NUM_QUESTIONS, budget=None):
+    budget = budget or RetryBudget()
+    profile = MODEL_PROFILES[JSON_MODEL]
+    prompt = edit_mode_prompt(output, prompt_type)
+    max_tokens = num_questions * profile.question_size
+    prompt_tokens = count_message_tokens(prompt.messages, profile.encoding)
+
+    # drafts whose conversion doesn't fit in the model's context are converted half at a time
+    if prompt_tokens + max_tokens > profile.context_window:
+        halves = halve_draft(output)
+        if halves is None:
+            return []
+
+        first, second, share = halves
+        first_questions = min(num_questions, math.ceil(num_questions * share))
+
+        converted = await asyncio.gather(
+            postprocess_with_gpt_async(first, prompt_type, first_questions, budget),
+            postprocess_with_gpt_async(second, prompt_type, num_questions - first_questions, budget),
+        )
+        return (converted[0] + converted[1])[:num_questions]
+
+    if num_questions == 0:
+        return []
+
+    completion = await budget.create(
+        prompt_tokens,
+        model=JSON_MODEL,
+        messages=prompt.messages, 
+        max_tokens=max_tokens,
+        temperature=0.8,
+    )
+
+    # keep every usable question, so short batches can be topped up instead of regenerated
+    return valid_questions(decode_edited(completion["choices"][0]["message"]["content"]), prompt_type)[:num_questions]
+
+
+# labels that start each part of a generated question, at the start of a line
+# eg. "Question:", "Question 2:", "2. Question:"
+QUESTION_LABEL = re.compile(r"^[ \t]*(?:\d+[.)][ \t]*)?question(?:[ \t]*\d+)?[ \t]*:[ \t]*", re.IGNORECASE | re.MULTILINE)
+ANSWER_LABEL = re.compile(r"^[ \t]*(correct|incorrect)[ \t]+answer[ \t]*:[ \t]*", re.IGNORECASE | re.MULTILINE)
+FOLLOW_UP_LABEL = re.compile(r"^[ \t]*follow-up(?:[ \t]+question)?[ \t]*:[ \t]*", re.IGNORECASE | re.MULTILINE)
+
+# lettered answer choices listed under a question, eg. "B) In the function signature"
+OPTION_LABEL = re.compile(r"^[ \t]*([A-H])[).][ \t]+", re.MULTILINE)
+
+# answer given as an option's letter, eg. "B" or "B) In the function signature"
+LETTER_ANSWER = re.compile(r"^([A-H])(?:[).](?:\s+.*)?)?$", re.DOTALL)
+
+# fewest answer choices, including the correct answer, of a usable MCQ
+MIN_OPTIONS = 4
+
+
+# split model output into question blocks, dropping any text before the first question
+def split_questions(output: str):
+    return QUESTION_LABEL.split(output)[1:]
+
+
+# split `text` at each match of `label`, returning the leading text and (match, text) pairs
+def split_labeled(text: str, label: re.Pattern):
+    matches = list(label.finditer(text))
+    ends = [match.start() for match in matches[1:]] + [len(text)]
+
+    head = text[:matches[0].start()] if matches else text
+    return head, [(match, text[match.end():end].strip()) for match, end in zip(matches, ends)]
+
+
+# question in the MCQ template, with either full answers or letters of listed options
+# returns None when any part is missing
+def parse_mcq(block: str):
+    question, answers = split_labeled(block, ANSWER_LABEL)
+    options = {}
+
+    # only look for listed options when answers refer to them, so code in the question is left intact
+    if any(LETTER_ANSWER.match(text) for _, text in answers):
+        question, listed = split_labeled(question, OPTION_LABEL)
+        options = { match.group(1): text for match, text in listed }
+
+    # resolve answers given as letters of listed options
+    def resolve(answer):
+        letter = LETTER_ANSWER.match(answer)
+        return options[letter.group(1)] if letter and letter.group(1) in options else answer
+
+    correct = [resolve(text) for match, text in answers if match.group(1).lower() == "correct"]
+    incorrect = [resolve(text) for match, text in answers if match.group(1).lower() == "incorrect"]
+
+    if not question.strip() or len(correct) != 1 or 1 + len(incorrect) < MIN_OPTIONS or not all(correct + incorrect):
+        return None
+
+    return {
+        "question": question.strip(),
+        "correct": correct[0],
+        "incorrect": incorrect,
+    }
+
+
+# question in the open-ended template, None when either part is missing
+def parse_open_ended(block: str):
+    question, follow_ups = split_labeled(block, FOLLOW_UP_LABEL)
 
-    # grab correct answer, if no incorrect answers return False
-    correct, _, remaining = remaining.partition("\nIncorrect answer: ")
-    if correct == "":
+    if not question.strip() or len(follow_ups) != 1 or not follow_ups[0][1]:
+        return None
+
+    return {
+        "question": question.strip(),
+        "follow-up": follow_ups[0][1],
+    }
+
+
+TEMPLATE_PARSERS = {
+    PromptType.MCQ: parse_mcq,
+    PromptType.OPEN_ENDED: parse_open_ended,
+}
+
+
+# questions written in the prompt's template, None for each malformed question
+def parse_template(output: str, prompt_type: PromptType):
+    parse = TEMPLATE_PARSERS.get(prompt_type)
+    if parse is None:
+        return []
+
+    return [parse(block) for block in split_questions(output)]
+
+
+# parse questions written in the prompt's template, False unless all `num_questions` are well-formed
+def parse_questions(output: str, prompt_type: PromptType, num_questions=NUM_QUESTIONS):
+    parsed = parse_template(output, prompt_type)
+
+    if len(parsed) != num_questions or None in parsed:
         return False
-    
-    # add correct answer to list of choices
-    options = [{
-        "text": correct,
-        "predicted_feedback": FeedbackTypes.correct,
-    }]
-
-    # recurse over remaining choices until no incorrect answers left
-    while remaining != "":
-        answer, _, remaining = remaining.partition("\nIncorrect answer: ")
-
-        # when no choices left, add remaining text as an option
-        if answer == "":
-            options.append({
-                "text": remaining,
-                "predicted_feedback": FeedbackTypes.incorrect,
-            })
-
-            break
-        
-        options.append({
-            "text": answer,
-            "predicted_feedback": FeedbackTypes.incorrect,
-        })
-
-    if len(options) < 4:
+
+    return parsed
+
+
+# well-formed questions in a draft that couldn't be fully parsed, from either its template or JSON
+def salvage_questions(draft: str, prompt_type: PromptType):
+    template = [question for question in parse_template(draft, prompt_type) if question is not None]
+    edited = valid_questions(decode_edited(draft), prompt_type)
+
+    return max(template, edited, key=len)
+
+
+# start of a JSON array of questions, after any code fence
+JSON_ARRAY_START = re.compile(r"^\s*(?:```(?:json)?\s*)?\[")
+
+# separators between questions in a JSON array
+JSON_SEPARATOR = re.compile(r"[\s,]*")
+
+
+# parses questions from a draft as it streams in, so each question can be used once it's complete
+class QuestionStream:
+    def __init__(self, prompt_type: PromptType, output_format: OutputFormat):
+        self.prompt_type = prompt_type
+        self.output_format = output_format
+        self.text = ""
+        self.questions = []
+
+        # template blocks, or characters of JSON, already parsed
+        self.parsed = 0
+
+    # add streamed text, returning the questions it completes
+    def feed(self, text: str):
+        self.text += text
+        return self.parse(final=False)
+
+    # parse the rest of the draft once the stream has ended
+    def close(self):
+        return self.parse(final=True)
+
+    def parse(self, final):
+        if self.output_format == OutputFormat.JSON:
+            complete = self.parse_json()
+        else:
+            complete = self.parse_template(final)
+
+        self.questions.extend(complete)
+        return complete
+
+    # blocks followed by another question are complete, the last block only once the stream has ended
+    # since its answers can go on over several lines (eg. code blocks)
+    def parse_template(self, final):
+        parse = TEMPLATE_PARSERS.get(self.prompt_type)
+        if parse is None:
+            return []
+
+        blocks = split_questions(self.text)
+        complete = []
+
+        for index in range(self.parsed, len(blocks)):
+            if index == len(blocks) - 1 and not final:
+                break
+
+            question = parse(blocks[index])
+            self.parsed = index + 1
+            if question is not None:
+                complete.append(question)
+
+        return complete
+
+    # questions are complete once their object's closing brace has streamed in
+    def parse_json(self):
+        if self.parsed == 0:
+            start = JSON_ARRAY_START.match(self.text)
+            if start is None:
+                return []
+
+            self.parsed = start.end()
+
+        decoder = json.JSONDecoder()
+        complete = []
+
+        while True:
+            position = JSON_SEPARATOR.match(self.text, self.parsed).end()
+            if position == len(self.text) or self.text[position] == "]":
+                return complete
+
+            try:
+                question, self.parsed = decoder.raw_decode(self.text, position)
+            except json.JSONDecodeError:
+                return complete
+
+            complete.extend(valid_questions([question], self.prompt_type))
+
+
+# parse a draft without the JSON model, False unless all `num_questions` are well-formed
+# drafts follow the prompt's template, or are JSON when generated in `OutputFormat.JSON`
+def parse_draft(draft: str, prompt_type: PromptType, num_questions=NUM_QUESTIONS):
+    return parse_questions(draft, prompt_type, num_questions) or parse_edited(draft, num_questions, prompt_type)
+
+
+# convert a generated draft to questions, parsing it locally before converting with `JSON_MODEL`
+# failed conversions are retried without regenerating the draft
+# returns up to `num_questions` questions, keeping the largest short batch when none are complete
+async def convert_draft(draft: str, prompt_type: PromptType, num_questions=NUM_QUESTIONS, budget=None):
+    budget = budget or RetryBudget()
+
+    parsed = parse_draft(draft, prompt_type, num_questions)
+    if parsed:
+        return parsed
+
+    # extra questions are trimmed, a short batch is converted in case the model finds the rest
+    questions = salvage_questions(draft, prompt_type)[:num_questions]
+    if len(questions) == num_questions:
+        return questions
+
+    for _ in range(budget.policy.conversion_attempts):
+        tokens = budget.tokens
+
+        processed = await postprocess_with_gpt_async(draft, prompt_type, num_questions, budget)
+        if len(processed) == num_questions:
+            return processed
+
+        # conversions that don't improve on the batch so far are wasted
+        if len(processed) > len(questions):
+            questions = processed
+        else:
+            budget.discard(tokens)
+
+    return questions
+
+
+def postprocess_with_gpt(output: str, prompt_type: PromptType, num_questions=NUM_QUESTIONS, budget=None):
+    return get_executor().run(postprocess_with_gpt_async, output, prompt_type, num_questions, budget)
+
+
+# convert a completed question from the `ADD_ANSWERS` prompt to answer choices for `shard`
+def postprocess_manual(answers: str, shard: int):
+    blocks = split_questions(answers)
+    parsed = parse_mcq(blocks[0]) if len(blocks) == 1 else None
+
+    if parsed is None:
         return False
 
+    options = [{ "text": parsed["correct"], "predicted_feedback": FeedbackTypes.correct }]
+    options.extend({ "text": answer, "predicted_feedback": FeedbackTypes.incorrect } for answer in parsed["incorrect"])
+
     return {
-        "question": question,
+        "question": parsed["question"],
         "options": options,
         "shard": shard,
     }
@@ -17,7 +17,15 @@ TeachGPT follows these rules:
 * Questions should be more than one sentence, and should provide a code snippet or hypothetical situation to ask about.
 * Questions should be multiple-choice with four options. The correct answer choice should be indicated.
 
-You will generate {num_questions} questions. {custom_prompt}
+You will generate {num_questions} questions. Use the following template for each question, writing out the full text of every answer choice:
+
+Question:
+Correct answer:
+Incorrect answer:
+Incorrect answer:
+Incorrect answer:
+
+{custom_prompt}
 """,
     PromptType.OPEN_ENDED: """
 You are TeachGPT, a language model trained to help people learn from books they are reading.
@@ -49,6 +57,62 @@ You will be given a partially-complete question. Add the remaining answer choice
 """
 }
 
+# format of questions written by the model
+class OutputFormat(Enum):
+    # plain text following each prompt's template, converted to JSON afterwards
+    TEMPLATE = 1
+
+    # JSON matching the schema questions are stored with, parsed directly
+    JSON = 2
+
+# prompts asking for questions as JSON, skipping the conversion step
+JSON_PROMPTS = {
+    PromptType.MCQ: """
+You are TeachGPT, a machine learning agent trained to generate educational quizzes. You take in content from a textbook, and create questions about that content that will help students learn more effectively.
+
+TeachGPT follows these rules:
+* Questions should not copy-paste definitions or code from the content. Questions should apply the content to a new situation.
+* Questions should be more than one sentence, and should provide a code snippet or hypothetical situation to ask about.
+* Questions should be multiple-choice with four options.
+
+You will generate {num_questions} questions. {custom_prompt}
+
+Respond with only a JSON array of {num_questions} objects, without any other text. Each object uses the following schema:
+{{"question": "", "correct": "", "incorrect": ["", "", ""]}}
+
+"correct" and "incorrect" contain the complete text of each answer choice, not a letter. Include code snippets in the "question" and answer fields.
+""",
+    PromptType.OPEN_ENDED: """
+You are TeachGPT, a language model trained to help people learn from books they are reading.
+You will be given an excerpt from a book. You will give as output a set of open-ended questions
+about the excerpt. Each question should encourage readers to think deeply about the meaning of the excerpt.
+You will generate {num_questions} questions. {custom_prompt}
+
+Respond with only a JSON array of {num_questions} objects, without any other text. Each object uses the following schema:
+{{"question": "", "follow-up": ""}}
+""",
+}
+
+# system prompts for each output format
+PROMPT_VARIANTS = {
+    OutputFormat.TEMPLATE: PROMPTS,
+    OutputFormat.JSON: JSON_PROMPTS,
+}
+
+# output format used to generate each prompt type, `ADD_ANSWERS` always completes a template
+OUTPUT_FORMATS = {
+    PromptType.MCQ: OutputFormat.TEMPLATE,
+    PromptType.OPEN_ENDED: OutputFormat.TEMPLATE,
+    PromptType.ADD_ANSWERS: OutputFormat.TEMPLATE,
+}
+
+# sent after the content when topping up a short batch, so new questions don't repeat the ones kept
+TOP_UP_INSTRUCTION = """
+Questions have already been written about this content. Write new questions that are different from these:
+
+{questions}
+"""
+
 class Message(TypedDict):
     role: str
     content: str
@@ -57,12 +121,14 @@ class Prompt:
     messages: List[Message]
     num_questions: int
     prompt_type: PromptType
+    output_format: OutputFormat
     custom_prompt: None | str
 
-    def __init__(self, custom_prompt=None, prompt_type=PromptType.MCQ, num_questions=NUM_QUESTIONS):
+    def __init__(self, custom_prompt=None, prompt_type=PromptType.MCQ, num_questions=NUM_QUESTIONS, output_format=None):
         self.messages = []
         self.prompt_type = prompt_type
         self.num_questions = num_questions
+        self.output_format = output_format or OUTPUT_FORMATS[prompt_type]
 
         self.custom_prompt = "" if not custom_prompt else custom_prompt
 
@@ -75,9 +141,16 @@ class Prompt:
         return self
 
     def add_system_prompt(self) -> Prompt:
-        intro = PROMPTS[self.prompt_type].format(
+        intro = PROMPT_VARIANTS[self.output_format][self.prompt_type].format(
             num_questions=self.num_questions,
             custom_prompt=self.custom_prompt
         )
 
         return self.add_message(role="system", content=intro)
+
+    def add_kept_questions(self, questions) -> Prompt:
+        if not questions:
+            return self
+
+        listed = "\n".join(f"- {question['question']}" for question in questions)
+        return self.add_message(role="user", content=TOP_UP_INSTRUCTION.format(questions=listed))
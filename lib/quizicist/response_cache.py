@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Optional
+from .errors import QuizicistError
+
+# how API responses are cached:
+# "off" never caches, "readwrite" reuses stored responses and stores new ones,
+# "record" always calls the API and stores its responses, "replay" only uses stored responses
+CACHE_MODES = ["off", "readwrite", "record", "replay"]
+RESPONSE_CACHE_MODE = os.getenv("QUIZICIST_RESPONSE_CACHE", "off")
+
+# database of cached responses, shared by all processes on a host
+RESPONSE_CACHE_PATH = os.getenv("QUIZICIST_RESPONSE_CACHE_PATH") or os.path.join(tempfile.gettempdir(), "quizicist-responses.sqlite3")
+
+# seconds a response is reused for, ignored when replaying
+RESPONSE_CACHE_TTL = float(os.getenv("QUIZICIST_RESPONSE_CACHE_TTL", str(30 * 24 * 60 * 60)))
+
+# most bytes of responses kept, evicting the least recently used
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("QUIZICIST_RESPONSE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+
+# raised when replaying and a call has no stored response
+class ResponseCacheMissError(QuizicistError):
+    pass
+
+
+# cache key for a chat API call: a hash of its model, messages and sampling parameters
+# `occurrence` counts earlier identical calls by the same request, so a retry is never answered with the response it's retrying
+def request_key(kwargs, occurrence=0) -> str:
+    if occurrence:
+        kwargs = dict(kwargs, occurrence=occurrence)
+
+    return hashlib.sha256(json.dumps(kwargs, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+# chat API responses stored in SQLite, keyed by request
+class ResponseCache:
+    def __init__(self, path=RESPONSE_CACHE_PATH, mode="readwrite", ttl=RESPONSE_CACHE_TTL, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unsupported response cache mode: {mode}")
+
+        self.path = path
+        self.mode = mode
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        # connections can't be shared with forked processes, each process opens its own
+        self.connection = None
+        self.connection_pid = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        if self.connection_pid != os.getpid():
+            self.connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )
+            """)
+            self.connection_pid = os.getpid()
+
+        return self.connection
+
+    # stored response for a call, None when there's no usable response
+    def get(self, kwargs, occurrence=0):
+        if self.mode not in ["readwrite", "replay"]:
+            return None
+
+        key = request_key(kwargs, occurrence)
+
+        with self.lock:
+            connection = self.connect()
+            row = connection.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+
+            # recordings never expire when replaying
+            if row is None or (self.mode != "replay" and time.time() - row[1] > self.ttl):
+                if self.mode == "replay":
+                    raise ResponseCacheMissError("No recorded response for this request.")
+
+                return None
+
+            with connection:
+                connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+
+        return json.loads(row[0])
+
+    def put(self, kwargs, response, occurrence=0):
+        if self.mode not in ["readwrite", "record"]:
+            return
+
+        encoded = json.dumps(response)
+        now = time.time()
+
+        with self.lock, self.connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (request_key(kwargs, occurrence), encoded, len(encoded), now, now),
+            )
+            self.evict(connection)
+
+    # drop expired responses, then the least recently used until the cache fits in `max_bytes`
+    def evict(self, connection):
+        connection.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        for key, size in connection.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+            connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+
+            if total <= self.max_bytes:
+                return
+
+    # replay a stored response to a streamed call, one chunk per choice
+    @staticmethod
+    async def replay_stream(response):
+        for index, choice in enumerate(response["choices"]):
+            yield { "choices": [{ "index": index, "delta": { "content": choice["message"]["content"] } }] }
+
+    # pass a streamed response through, storing its text once the stream has been read to the end
+    # streams closed early or cancelled aren't stored, since they'd be replayed as if they were complete
+    async def record_stream(self, kwargs, chunks, occurrence=0):
+        contents = {}
+
+        try:
+            async for chunk in chunks:
+                for choice in chunk["choices"]:
+                    contents[choice["index"]] = contents.get(choice["index"], "") + (choice["delta"].get("content") or "")
+
+                yield chunk
+        except GeneratorExit:
+            await chunks.aclose()
+            raise
+
+        self.put(kwargs, self.stream_response(contents), occurrence)
+
+    @staticmethod
+    def stream_response(contents):
+        return {
+            "choices": [
+                { "index": index, "message": { "role": "assistant", "content": content } }
+                for index, content in sorted(contents.items())
+            ],
+        }
+
+
+# cache in front of every chat API call in the process, None when caching is off
+response_cache: Optional[ResponseCache] = None
+if RESPONSE_CACHE_MODE != "off":
+    response_cache = ResponseCache(mode=RESPONSE_CACHE_MODE)
+
+
+def configure_response_cache(mode, path=RESPONSE_CACHE_PATH, ttl=RESPONSE_CACHE_TTL, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+    global response_cache
+    response_cache = None if mode == "off" else ResponseCache(path, mode, ttl, max_bytes)
+
+
+# stored response for a call, or None when the API must be called
+def lookup(kwargs, occurrence=0):
+    if response_cache is None:
+        return None
+
+    response = response_cache.get(kwargs, occurrence)
+    if response is not None and kwargs.get("stream"):
+        return ResponseCache.replay_stream(response)
+
+    return response
+
+
+# store a call's response, returning the response to use in its place
+def store(kwargs, response, occurrence=0):
+    if response_cache is None:
+        return response
+
+    if kwargs.get("stream"):
+        return response_cache.record_stream(kwargs, response, occurrence)
+
+    response_cache.put(kwargs, response, occurrence)
+    return response
@@ -0,0 +1,199 @@
+import asyncio
+import math
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+import openai
+import openai.error
+from .errors import QuizicistError
+from .governor import admit
+from .response_cache import lookup, request_key, store
+
+# OpenAI errors worth retrying after a pause
+TRANSIENT_ERRORS = (
+    openai.error.APIConnectionError,
+    openai.error.APIError,
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.Timeout,
+    openai.error.TryAgain,
+)
+
+
+# limits on how hard a single request (eg. an upload) retries failed generations
+@dataclass(frozen=True)
+class RetryPolicy:
+    # attempts per shard job, counting unparseable output and transient API errors separately
+    max_attempts: int = int(os.getenv("QUIZICIST_MAX_ATTEMPTS", "3"))
+
+    # JSON conversions of a single draft before the draft is regenerated
+    conversion_attempts: int = 2
+
+    # exponential backoff between transient API errors, in seconds
+    base_delay: float = 1
+    max_delay: float = 20
+
+    # total tokens and seconds a request may spend across all of its jobs and attempts
+    token_budget: int = int(os.getenv("QUIZICIST_TOKEN_BUDGET", "60000"))
+    time_budget: float = float(os.getenv("QUIZICIST_TIME_BUDGET", "150"))
+
+    # most candidate drafts requested in one call, 1 to always request a single draft
+    max_candidates: int = int(os.getenv("QUIZICIST_MAX_CANDIDATES", "3"))
+
+    # chance of every candidate failing to parse that calls request enough candidates to stay under
+    target_failure_rate: float = 0.05
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+
+# raised when a request runs out of attempts or budget before producing usable questions
+class RetryBudgetExceededError(QuizicistError):
+    pass
+
+
+# weight of the latest draft in each prompt type's parse failure rate
+FAILURE_SMOOTHING = 0.1
+
+
+# moving average of how often drafts are unusable even after conversion, by prompt type, shared by the process
+class FailureRates:
+    def __init__(self, smoothing=FAILURE_SMOOTHING):
+        self.smoothing = smoothing
+        self.rates = {}
+        self.lock = threading.Lock()
+
+    def record(self, prompt_type, failed):
+        with self.lock:
+            rate = self.rates.get(prompt_type, 0)
+            self.rates[prompt_type] = rate + self.smoothing * (failed - rate)
+
+    def rate(self, prompt_type):
+        with self.lock:
+            return self.rates.get(prompt_type, 0)
+
+    # fewest candidates per call making every candidate failing less likely than the policy's target
+    def candidates(self, prompt_type, policy: RetryPolicy):
+        rate = self.rate(prompt_type)
+
+        if rate <= policy.target_failure_rate:
+            return 1
+        if rate >= 1:
+            return policy.max_candidates
+
+        needed = math.ceil(math.log(policy.target_failure_rate) / math.log(rate))
+        return max(1, min(needed, policy.max_candidates))
+
+
+failure_rates = FailureRates()
+
+
+# a request's spending against its retry policy, shared by the request's jobs
+class RetryBudget:
+    def __init__(self, policy: RetryPolicy = DEFAULT_RETRY_POLICY):
+        self.policy = policy
+        self.started = time.monotonic()
+
+        # API calls made, and calls repeated after an error or unusable output
+        self.calls = 0
+        self.retries = 0
+
+        # follow-up generations asking only for the questions a short batch was missing
+        self.top_ups = 0
+
+        # tokens used by all calls, and by calls whose output was thrown away
+        self.tokens = 0
+        self.wasted_tokens = 0
+
+        # raw generations, kept so drafts that failed conversion can be reprocessed
+        self.drafts = []
+
+        # well-formed questions from unused candidates, by shard, drawn on before generating more
+        self.reserve = {}
+
+        # times each identical call was made, so cached responses aren't reused by retries
+        self.occurrences = {}
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "top_ups": self.top_ups,
+            "tokens": self.tokens,
+            "wasted_tokens": self.wasted_tokens,
+            "elapsed": self.elapsed,
+        }
+
+    def check(self):
+        if self.tokens >= self.policy.token_budget or self.elapsed >= self.policy.time_budget:
+            raise RetryBudgetExceededError("We couldn't generate questions for your content. Please try again later.")
+
+    # delay before the next attempt, with full jitter
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.policy.max_delay, self.policy.base_delay * 2 ** attempt))
+
+    # call the chat API, retrying transient errors with backoff
+    # `prompt_tokens` is used to hold the call within the account's rate limits
+    # responses come from the response cache when it's enabled and has the call
+    async def create(self, prompt_tokens, **kwargs):
+        key = request_key(kwargs)
+        occurrence = self.occurrences.get(key, 0)
+        self.occurrences[key] = occurrence + 1
+
+        completion = lookup(kwargs, occurrence)
+
+        for attempt in range(self.policy.max_attempts):
+            if completion is not None:
+                break
+
+            self.check()
+            await admit(kwargs["model"], prompt_tokens + kwargs["max_tokens"] * kwargs.get("n", 1))
+
+            try:
+                self.calls += 1
+                completion = store(kwargs, await openai.ChatCompletion.acreate(**kwargs), occurrence)
+            except TRANSIENT_ERRORS:
+                if attempt + 1 == self.policy.max_attempts:
+                    raise
+
+                self.retries += 1
+                await asyncio.sleep(self.backoff(attempt))
+
+        # streamed completions report no usage, their callers `spend` the tokens they read
+        if not kwargs.get("stream"):
+            self.tokens += completion.get("usage", {}).get("total_tokens", 0)
+
+        return completion
+
+    def spend(self, tokens):
+        self.tokens += tokens
+
+    # count tokens spent between `start` and `end` (default: now) as wasted, before retrying unusable output
+    def discard(self, start, end=None):
+        self.wasted_tokens += (self.tokens if end is None else end) - start
+        self.retries += 1
+
+    def record_draft(self, content, prompt_type, num_questions, converted):
+        self.drafts.append({
+            "content": content,
+            "prompt_type": prompt_type,
+            "num_questions": num_questions,
+            "converted": converted,
+        })
+
+    def bank(self, shard, questions):
+        self.reserve.setdefault(shard, []).extend(questions)
+
+    # take up to `count` reserved questions for `shard`, skipping any in `exclude`
+    def withdraw(self, shard, count, exclude=()):
+        reserved = [question for question in self.reserve.pop(shard, []) if question["question"] not in exclude]
+        if reserved[count:]:
+            self.reserve[shard] = reserved[count:]
+
+        return reserved[:count]
@@ -0,0 +1,126 @@
+import os
+import threading
+from itertools import islice
+from typing import Iterable, List
+from .consts import GPT_MODEL, MODEL_PROFILES
+
+# BPE encoding used to count tokens, matches the question generation model
+DEFAULT_ENCODING = MODEL_PROFILES[GPT_MODEL].encoding
+
+# token counting backend: "bpe" (bundled merge tables) or "transformers"
+TOKEN_COUNTER = os.getenv("QUIZICIST_TOKEN_COUNTER", "bpe")
+
+# pretrained transformers tokenizers for each supported encoding
+TRANSFORMERS_TOKENIZERS = {
+    "gpt2": "gpt2",
+}
+
+# tokens added by the chat format around each message and before the reply
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+# number of components whose tokens are counted in a single batch while streaming
+COMPONENT_BATCH_SIZE = 256
+
+# maximum number of memoized token counts before the cache is reset
+TOKEN_CACHE_SIZE = 16384
+
+# process-wide token counters, loaded on first use
+tokenizers = {}
+tokenizers_lock = threading.Lock()
+
+# token counts of previously seen strings (blank lines, code boilerplate, etc.)
+# shared by request threads and the executor's thread
+token_cache = {}
+token_cache_lock = threading.Lock()
+
+
+# standalone BPE engine, works offline without importing transformers
+def load_bpe_counter(encoding):
+    from .bpe import load_encoding
+
+    return load_encoding(encoding).count_batch
+
+
+# rust-backed tokenizer, produces the same GPT-2 BPE tokens as `GPT2Tokenizer`
+def load_transformers_counter(encoding):
+    from transformers import GPT2TokenizerFast
+
+    tokenizer = GPT2TokenizerFast.from_pretrained(TRANSFORMERS_TOKENIZERS[encoding])
+    return lambda texts: [len(ids) for ids in tokenizer(texts, add_special_tokens=False)["input_ids"]]
+
+
+COUNTER_LOADERS = {
+    "bpe": load_bpe_counter,
+    "transformers": load_transformers_counter,
+}
+
+
+# resolve counter backend, encodings without a pretrained tokenizer always use bundled BPE
+def resolve_counter(encoding, counter=None):
+    counter = counter or TOKEN_COUNTER
+
+    if counter == "transformers" and encoding not in TRANSFORMERS_TOKENIZERS:
+        return "bpe"
+
+    return counter
+
+
+# return shared batch token counter, loading it on first use
+def get_tokenizer(encoding=DEFAULT_ENCODING, counter=None):
+    key = (resolve_counter(encoding, counter), encoding)
+
+    if key not in tokenizers:
+        with tokenizers_lock:
+            if key not in tokenizers:
+                tokenizers[key] = COUNTER_LOADERS[key[0]](encoding)
+
+    return tokenizers[key]
+
+
+# load tokenizers ahead of first use, eg. in the gunicorn master so forked workers share them
+def preload_tokenizers(*encodings):
+    for encoding in encodings or [DEFAULT_ENCODING]:
+        get_tokenizer(encoding)
+
+
+# count tokens for a batch of strings, tokenizing unseen strings in a single call
+def count_tokens(texts: Iterable[str], encoding=DEFAULT_ENCODING, counter=None) -> List[int]:
+    texts = list(texts)
+
+    # counts are read into a local dict under the lock, since other threads can clear the shared cache at any time
+    with token_cache_lock:
+        cache = token_cache.setdefault((resolve_counter(encoding, counter), encoding), {})
+        counts = { text: cache[text] for text in texts if text in cache }
+
+    unseen = list(dict.fromkeys(text for text in texts if text not in counts))
+
+    if unseen:
+        counts.update(zip(unseen, get_tokenizer(encoding, counter)(unseen)))
+
+        with token_cache_lock:
+            if len(cache) + len(unseen) > TOKEN_CACHE_SIZE:
+                cache.clear()
+
+            cache.update((text, counts[text]) for text in unseen)
+
+    return [counts[text] for text in texts]
+
+
+# yield {"text", "tokens"} components for a stream of texts, counting tokens in batches
+def count_components(texts: Iterable[str], encoding=DEFAULT_ENCODING, batch_size=COMPONENT_BATCH_SIZE):
+    texts = iter(texts)
+
+    while batch := list(islice(texts, batch_size)):
+        for text, tokens in zip(batch, count_tokens(batch, encoding)):
+            yield { "text": text, "tokens": tokens }
+
+
+# count tokens in a list of chat messages, including chat format overhead
+def count_message_tokens(messages, encoding=DEFAULT_ENCODING) -> int:
+    contents = [message["content"] for message in messages]
+    roles = [message["role"] for message in messages]
+
+    return sum(count_tokens(contents + roles, encoding)) \
+        + len(messages) * TOKENS_PER_MESSAGE \
+        + TOKENS_PER_REPLY
@@ -4,17 +4,28 @@ setup(
     name="quizicist",
     version="0.1.0",
     packages=["quizicist"],
+    package_data={
+        "quizicist": ["data/*"]
+    },
     install_requires=[
         "openai==0.27.2", 
         "python-dotenv==0.21.0", 
         "mistletoe==0.9.0",
-        "transformers==4.22.1",
-        "beautifulsoup4==4.11.1",
-        "lxml==4.9.1",
+        "regex==2022.10.31",
+        "numpy==1.24.2",
+        "aiohttp==3.8.4",
     ],
     extras_require={
         "dev": [
-            "pytest==7.2.2"
+            "pytest==7.2.2",
+            "beautifulsoup4==4.11.1",
+            "lxml==4.9.1",
+        ],
+        "transformers": [
+            "transformers==4.22.1"
+        ],
+        "memcached": [
+            "pymemcache==4.0.0"
         ]
     }
 )
\ No newline at end of file
@@ -0,0 +1,126 @@
+import asyncio
+import json
+import pathlib
+import openai
+from quizicist import completion
+from quizicist.completion import divide_questions, plan_jobs, shard_capacity, shard_chapter, shard_context_size
+from quizicist.consts import JSON_MODEL, MODEL_PROFILES
+from quizicist.parsers.md import md_parser
+from quizicist.prompt import OutputFormat, PromptType
+
+CHAPTER = pathlib.Path(__file__).parents[2].joinpath("experiments", "plai", "smol-reactivity.md")
+QUESTION = { "question": "question", "correct": "a", "incorrect": ["b", "c", "d"] }
+
+
+def test_shard_context_size():
+    profile = MODEL_PROFILES["gpt-4"]
+    output_size = profile.questions_per_call * profile.question_size
+
+    # system prompt is counted against the shard budget
+    assert shard_context_size("gpt-4") < profile.context_window - output_size
+    assert shard_context_size("gpt-3.5-turbo") < shard_context_size("gpt-4")
+
+
+def test_chapter_fits_in_single_shard():
+    shards = shard_chapter(md_parser(CHAPTER.read_text()), model="gpt-4")
+    assert len(shards) == 1
+
+
+def test_divide_questions():
+    jobs = divide_questions(["a", "b"], 11, None, None, model="gpt-4")
+
+    assert [job[:3] for job in jobs] == [(0, "a", 6), (1, "b", 5)]
+
+
+def test_plan_jobs():
+    shard = "content " * 1000
+    capacity = shard_capacity(shard, None, PromptType.MCQ, model="gpt-4")
+
+    # a shard's questions are merged into one call when its output budget allows
+    assert [job[:3] for job in plan_jobs(["a", "b"], 15, None, PromptType.MCQ, model="gpt-4")] == [(0, "a", 8), (1, "b", 7)]
+
+    jobs = plan_jobs([shard], capacity + 1, None, PromptType.MCQ, model="gpt-4")
+    assert len(jobs) == 2 and sum(job[2] for job in jobs) == capacity + 1
+
+    # shards too large for their output budget still get the profile's questions per call
+    assert shard_capacity("content " * 8000, None, PromptType.MCQ, model="gpt-4") == MODEL_PROFILES["gpt-4"].questions_per_call
+
+
+# stand-in for the chat API, converting questions to JSON when called with the JSON model
+class FakeChatCompletion:
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def acreate(self, model, messages, max_tokens, **kwargs):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+
+        num_questions = max_tokens // MODEL_PROFILES[model].question_size
+        if model == JSON_MODEL:
+            questions = [dict(QUESTION, question=f"{index}?") for index in range(num_questions)]
+            return { "choices": [{ "message": { "content": json.dumps(questions) } }] }
+
+        async def chunks():
+            yield { "choices": [{ "index": 0, "delta": { "content": "questions" } }] }
+
+        return chunks() if kwargs.get("stream") else { "choices": [{ "message": { "content": "questions" } }] }
+
+
+def test_complete_shards(monkeypatch):
+    chat = FakeChatCompletion()
+    monkeypatch.setattr(openai.ChatCompletion, "acreate", chat.acreate)
+
+    # shards with identical text are still kept apart
+    surfaced = []
+    results = asyncio.run(completion.complete_shards_async(["a", "a", "c"], 15, model="gpt-4", concurrency=2, on_question=lambda shard, _: surfaced.append(shard)))
+
+    assert [len(questions) for questions in results] == [5, 5, 5]
+    assert sorted(surfaced) == [0] * 5 + [1] * 5 + [2] * 5
+    assert chat.max_in_flight == 2
+
+
+def test_complete_shards_iter(monkeypatch):
+    chat = FakeChatCompletion()
+
+    # the first shard's calls take longest
+    async def acreate(messages, stream=False, **kwargs):
+        if any(message["content"] == "slow" for message in messages):
+            await asyncio.sleep(0.2)
+
+        result = await chat.acreate(messages=messages, **kwargs)
+
+        async def chunks():
+            yield { "choices": [{ "index": 0, "delta": result["choices"][0]["message"] }] }
+
+        return chunks() if stream else result
+
+    monkeypatch.setattr(openai.ChatCompletion, "acreate", acreate)
+
+    shards = list(completion.complete_shards_iter(["slow", "b", "c"], 15, model=JSON_MODEL))
+
+    assert sorted(shard for shard, _ in shards[:2]) == [1, 2]
+    assert shards[2][0] == 0
+    assert [len(questions) for _, questions in shards] == [5, 5, 5]
+
+
+def test_complete_shards_output_format(monkeypatch):
+    requests = []
+
+    async def acreate(messages, max_tokens, stream=False, **kwargs):
+        requests.append(messages)
+        questions = [dict(QUESTION, question=f"{index}?") for index in range(5)]
+
+        async def chunks():
+            yield { "choices": [{ "index": 0, "delta": { "content": json.dumps(questions) } }] }
+
+        return chunks() if stream else { "choices": [{ "message": { "content": json.dumps(questions) } }] }
+
+    monkeypatch.setattr(openai.ChatCompletion, "acreate", acreate)
+
+    results = completion.complete_shards(["a", "b"], 10, model="gpt-4", output_format=OutputFormat.JSON)
+
+    assert [len(questions) for questions in results] == [5, 5]
+    assert all("JSON array" in messages[0]["content"] for messages in requests)
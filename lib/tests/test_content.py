@@ -0,0 +1,27 @@
+import io
+from quizicist.content import match_shards, parse_content
+from quizicist.parsers.text import parse_text
+
+CONTENT = "Ownership is a set of rules.\nEach value has an owner.\n"
+
+
+def test_parse_content_cached(tmp_path):
+    calls = []
+
+    def counting_parser(content):
+        calls.append(content)
+        return parse_text(content)
+
+    first = parse_content(io.StringIO(CONTENT), counting_parser, cache_dir=tmp_path)
+    second = parse_content(CONTENT, counting_parser, cache_dir=tmp_path)
+
+    assert first == second
+    assert len(calls) == 1
+    assert first["shards"] == [CONTENT + "\n"]
+    assert first["tokens"] == sum(component["tokens"] for component in first["components"])
+
+
+def test_match_shards():
+    shards = ["Ownership rules: each value has an owner.", "Borrowing lets functions use values without owning them."]
+
+    assert match_shards(shards, ["Who is a value's owner?", "What does borrowing let functions do?"]) == [0, 1]
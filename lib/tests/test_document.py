@@ -0,0 +1,52 @@
+from quizicist.document import Document
+
+COMPONENTS = [
+    { "text": "alpha ", "tokens": 3, "heading": False },
+    { "text": "beta ", "tokens": 4, "heading": False },
+    { "text": "gamma ", "tokens": 5, "heading": False },
+    { "text": "delta", "tokens": 6, "heading": False },
+]
+
+
+def make_document(tokens, headings=()):
+    return Document.from_components(
+        { "text": str(index), "tokens": count, "heading": index in headings }
+        for index, count in enumerate(tokens)
+    )
+
+
+def test_component_view():
+    document = Document.from_components(COMPONENTS)
+
+    assert len(document) == 4
+    assert list(document) == COMPONENTS
+    assert document[-1] == COMPONENTS[-1]
+    assert document.total_tokens == 18
+    assert document.span_text(1, 3) == "beta gamma "
+
+
+def test_shard_bounds():
+    document = Document.from_components(COMPONENTS)
+
+    assert document.shard_bounds(12) == [(0, 3), (3, 4)]
+
+    # components larger than the maximum get a shard of their own
+    assert document.shard_bounds(2) == [(0, 1), (1, 2), (2, 3), (3, 4)]
+
+
+def test_partition_is_balanced():
+    document = make_document([2, 2, 2, 2, 2, 2])
+
+    # greedy filling leaves a small tail shard, partitioning evens out shard sizes
+    assert document.shard_bounds(10) == [(0, 5), (5, 6)]
+    assert document.partition(10) == [(0, 3), (3, 6)]
+
+    assert make_document([1, 1, 1, 1, 8]).partition(10) == [(0, 4), (4, 5)]
+
+
+def test_partition_prefers_headings():
+    document = make_document([3, 3, 3, 3], headings=[1])
+
+    # the most even split cuts mid-section, slack allows cutting at the heading instead
+    assert document.partition(9) == [(0, 2), (2, 4)]
+    assert document.partition(9, slack=0.5) == [(0, 1), (1, 4)]
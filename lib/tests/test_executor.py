@@ -0,0 +1,81 @@
+import asyncio
+import threading
+import pytest
+from quizicist.errors import ExecutorSaturatedError
+from quizicist.executor import Executor, get_executor
+
+
+async def double(value):
+    await asyncio.sleep(0.01)
+    return value * 2
+
+
+def test_starmap():
+    executor = Executor(max_in_flight=2, max_queued=2)
+
+    assert executor.starmap(double, [(1,), (2,), (3,)]) == [2, 4, 6]
+    assert executor.gauges()["in_flight"] == 0
+    assert executor.gauges()["queued"] == 0
+
+
+async def wait(seconds):
+    await asyncio.sleep(seconds)
+    return seconds
+
+
+def test_as_completed():
+    executor = Executor(max_in_flight=3, max_queued=0)
+
+    assert list(executor.as_completed(wait, [(0.1,), (0.05,), (0,)])) == [(2, 0), (1, 0.05), (0, 0.1)]
+    assert executor.gauges()["in_flight"] == 0
+
+
+def test_saturated_executor_rejects_jobs():
+    executor = Executor(max_in_flight=1, max_queued=1)
+    release = threading.Event()
+
+    async def wait():
+        await asyncio.get_running_loop().run_in_executor(None, release.wait)
+
+    running = [executor.submit(wait), executor.submit(wait)]
+
+    with pytest.raises(ExecutorSaturatedError):
+        executor.submit(wait)
+
+    # rejected batches don't claim any capacity
+    with pytest.raises(ExecutorSaturatedError):
+        executor.starmap(double, [(1,), (2,)])
+
+    gauges = executor.gauges()
+    assert gauges["in_flight"] + gauges["queued"] == 2
+
+    release.set()
+    for future in running:
+        future.result()
+
+    assert executor.run(double, 4) == 8
+
+
+def test_cancelled_jobs_release_capacity():
+    executor = Executor(max_in_flight=1, max_queued=2)
+    release = threading.Event()
+
+    async def wait():
+        await asyncio.get_running_loop().run_in_executor(None, release.wait)
+
+    running = executor.submit(wait)
+    queued = [executor.submit(wait), executor.submit(wait)]
+
+    for future in queued:
+        future.cancel()
+
+    release.set()
+    running.result()
+
+    assert executor.gauges()["queued"] == 0
+    assert executor.gauges()["in_flight"] == 0
+    assert executor.run(double, 4) == 8
+
+
+def test_executor_is_shared():
+    assert get_executor() is get_executor()
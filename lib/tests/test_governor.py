@@ -0,0 +1,97 @@
+import asyncio
+import pytest
+from quizicist import governor
+from quizicist.governor import CAS_ATTEMPTS, MemcachedStorage, MemoryStorage, RateGovernor, RateLimit, StorageContentionError, take
+
+LIMIT = RateLimit(requests_per_minute=60, tokens_per_minute=6000)
+
+
+def test_take():
+    state, wait = take(None, LIMIT, 1000, now=0)
+    assert wait == 0
+    assert state == { "requests": 59, "tokens": 5000, "updated": 0 }
+
+    # out of tokens, wait for the bucket to refill
+    state, wait = take({ "requests": 59, "tokens": 500, "updated": 0 }, LIMIT, 1000, now=0)
+    assert wait == 5
+
+    # buckets refill over time
+    state, wait = take(state, LIMIT, 1000, now=5)
+    assert wait == 0
+    assert state["tokens"] == 0
+
+    # calls larger than the budget wait for a full bucket
+    _, wait = take(None, LIMIT, 10000, now=0)
+    assert wait == 0
+
+
+def test_governor_limits_requests():
+    rate_governor = RateGovernor(MemoryStorage(), { "gpt-4": RateLimit(requests_per_minute=2, tokens_per_minute=6000) })
+
+    assert rate_governor.try_acquire("gpt-4", 10) == 0
+    assert rate_governor.try_acquire("gpt-4", 10) == 0
+    assert rate_governor.try_acquire("gpt-4", 10) > 0
+
+    # models without limits are never held back
+    assert rate_governor.try_acquire("gpt-3.5-turbo", 10) == 0
+
+
+def test_admit_waits_for_capacity(monkeypatch):
+    waits = []
+
+    async def sleep(seconds):
+        waits.append(seconds)
+        storage.values[f"{governor.KEY_PREFIX}-gpt-4"]["tokens"] = 6000
+
+    storage = MemoryStorage()
+    monkeypatch.setattr(governor, "governor", RateGovernor(storage, { "gpt-4": LIMIT }))
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+
+    asyncio.run(governor.admit("gpt-4", 6000))
+    asyncio.run(governor.admit("gpt-4", 6000))
+
+    assert len(waits) == 1
+
+
+# stand-in for a pymemcache client, where another worker changes the key before the first `conflicts` check-and-sets
+class FakeCasClient:
+    def __init__(self, conflicts):
+        self.values = {}
+        self.conflicts = conflicts
+        self.attempts = 0
+
+    def gets(self, key):
+        return self.values.get(key, (None, None))
+
+    def add(self, key, value):
+        return self.cas(key, value, None)
+
+    def cas(self, key, value, cas):
+        self.attempts += 1
+        if self.attempts <= self.conflicts:
+            return False
+
+        self.values[key] = (value, self.attempts)
+        return True
+
+
+def test_memcached_storage_retries_conflicts():
+    storage = MemcachedStorage("localhost", 11211, client=FakeCasClient(conflicts=2))
+
+    assert storage.update("key", lambda value: ((value or 0) + 1, "done")) == "done"
+    assert storage.client.attempts == 3
+    assert storage.update("key", lambda value: (value + 1, value)) == 1
+
+
+def test_contended_storage_backs_off():
+    storage = MemcachedStorage("localhost", 11211, client=FakeCasClient(conflicts=CAS_ATTEMPTS))
+
+    with pytest.raises(StorageContentionError):
+        storage.update("key", lambda value: (value, None))
+
+    # the governor waits and tries again instead of spinning on the bucket
+    storage.client.attempts = 0
+    rate_governor = RateGovernor(storage, { "gpt-4": LIMIT })
+    assert rate_governor.try_acquire("gpt-4", 10) > 0
+    assert storage.client.attempts == CAS_ATTEMPTS
+    assert rate_governor.try_acquire("gpt-4", 10) == 0
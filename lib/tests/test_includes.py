@@ -0,0 +1,52 @@
+from quizicist.parsers import includes
+
+LISTING = """use std::io;
+
+// ANCHOR: main
+fn main() {
+    // ANCHOR: print
+    println!("Guess the number!");
+    // ANCHOR_END: print
+}
+// ANCHOR_END: main
+"""
+
+
+def write_book(tmp_path):
+    src = tmp_path / "src"
+    listing = tmp_path / "listings" / "main.rs"
+    src.mkdir()
+    listing.parent.mkdir()
+    listing.write_text(LISTING)
+
+    return str(src), listing
+
+
+def test_include_selectors(tmp_path):
+    book_dir, _ = write_book(tmp_path)
+    resolve = lambda directive: includes.resolve_include(directive, book_dir)
+
+    assert resolve("{{#include ../listings/main.rs:print}}") == '    println!("Guess the number!");\n'
+    assert resolve("{{#rustdoc_include ../listings/main.rs:main}}") == 'fn main() {\n    println!("Guess the number!");\n}\n'
+    assert resolve("{{#include ../listings/main.rs:1}}") == "use std::io;\n"
+    assert resolve("{{#include ../listings/main.rs::2}}") == "use std::io;\n\n"
+    assert resolve("{{#include ../listings/main.rs:5:}}") == '    println!("Guess the number!");\n}\n'
+    assert "ANCHOR" not in resolve("{{#include ../listings/main.rs}}")
+    assert resolve("{{#include ../listings/missing.rs}}") == ""
+    assert resolve("{{#playground ../listings/main.rs}}") == ""
+
+
+def test_include_cache(tmp_path, monkeypatch):
+    book_dir, listing = write_book(tmp_path)
+    includes.read_listing.cache_clear()
+
+    for _ in range(3):
+        includes.resolve_include("{{#include ../listings/main.rs:print}}", book_dir)
+    assert includes.read_listing.cache_info().misses == 1
+
+    # preloaded listings are served without touching the filesystem
+    includes.preload_book(str(tmp_path))
+    monkeypatch.setattr(includes.os, "stat", None)
+    assert includes.resolve_include("{{#include ../listings/main.rs:1}}", book_dir) == "use std::io;\n"
+
+    includes.preloaded_listings.clear()
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import pathlib
+import re
+import openai
+from quizicist.consts import JSON_MODEL, MODEL_PROFILES, FeedbackTypes
+from quizicist.postprocess import QuestionStream, conversion_capacity, parse_edited, parse_mcq, parse_questions, postprocess_manual, postprocess_with_gpt_async, split_questions
+from quizicist.prompt import OutputFormat, Prompt, PromptType
+from quizicist.tokens import count_message_tokens
+
+EXAMPLES = pathlib.Path(__file__).parents[2].joinpath("experiments", "edit-mode-to-json")
+
+
+# generated questions and their first JSON conversion from an edit mode experiment
+def load_example(name):
+    text = EXAMPLES.joinpath(name).read_text()
+
+    draft = re.search(r"# Input\n```\n(.*?)```", text, re.DOTALL).group(1)
+    converted = re.search(r"## Output 1\n```json\n(.*?)```", text, re.DOTALL).group(1)
+
+    return draft, json.loads(converted)
+
+
+def test_well_formatted_questions():
+    draft, converted = load_example("lifetimes-well-formatted-1.md")
+
+    assert parse_questions(draft, PromptType.MCQ, 5) == converted
+    assert parse_questions(draft, PromptType.MCQ, 4) is False
+
+
+def test_mcq_template():
+    prompt = Prompt(prompt_type=PromptType.MCQ).add_system_prompt().messages[0]["content"]
+    template = "Question:\nCorrect answer:\nIncorrect answer:\nIncorrect answer:\nIncorrect answer:\n"
+    assert template in prompt
+
+    # well-formatted drafts follow the prompt's template, and parse without a conversion
+    for name in ["lifetimes-well-formatted-0.md", "lifetimes-well-formatted-1.md"]:
+        draft, converted = load_example(name)
+        labels = re.findall(r"^(Question|Correct answer|Incorrect answer):", draft, re.MULTILINE)
+
+        assert "".join(f"{label}:\n" for label in labels) == template * len(converted)
+        assert [question["question"] for question in parse_questions(draft, PromptType.MCQ, len(converted))] == [question["question"] for question in converted]
+
+
+def test_lettered_options():
+    draft, converted = load_example("lifetimes-malformatted-0.md")
+    parsed = [parse_mcq(block) for block in split_questions(draft)]
+
+    # the final question has no answers, so it's left for the model to convert
+    assert parsed[:3] == converted[:3]
+    assert parsed[3] is None
+
+
+def test_code_in_question():
+    block = "What is printed?\nfn main() {\n    A: u8,\n}\nCorrect answer: 1\nIncorrect answer: 2\nIncorrect answer: 3\nIncorrect answer: 4"
+
+    assert parse_mcq(block)["question"] == "What is printed?\nfn main() {\n    A: u8,\n}"
+
+
+def test_open_ended_questions():
+    draft = "Question: Why?\nFollow-up question: Why not?\n\nQuestion 2: How?\nFollow-up question: How else?"
+
+    assert parse_questions(draft, PromptType.OPEN_ENDED, 2) == [
+        { "question": "Why?", "follow-up": "Why not?" },
+        { "question": "How?", "follow-up": "How else?" },
+    ]
+
+
+def test_postprocess_manual():
+    answers = "\nQuestion: What?\nCorrect answer: \nYes\nIncorrect answer: No\nIncorrect answer: Maybe\nIncorrect answer: Never"
+    processed = postprocess_manual(answers, 2)
+
+    assert processed["question"] == "What?"
+    assert processed["shard"] == 2
+    assert [option["text"] for option in processed["options"]] == ["Yes", "No", "Maybe", "Never"]
+    assert processed["options"][0]["predicted_feedback"] == FeedbackTypes.correct
+
+    assert postprocess_manual("\nQuestion: What?\nCorrect answer: Yes\nIncorrect answer: No", 0) is False
+
+
+def test_json_questions():
+    _, converted = load_example("lifetimes-well-formatted-1.md")
+    fenced = "```json\n" + json.dumps(converted) + "\n```"
+
+    assert parse_edited(fenced, 5, PromptType.MCQ) == converted
+
+    # questions missing fields of the prompt type's schema are rejected
+    assert parse_edited(json.dumps(converted), 5, PromptType.OPEN_ENDED) is False
+
+
+def test_question_stream():
+    draft, converted = load_example("lifetimes-well-formatted-1.md")
+
+    for output_format, text in [(OutputFormat.TEMPLATE, draft), (OutputFormat.JSON, json.dumps(converted, indent=2))]:
+        stream = QuestionStream(PromptType.MCQ, output_format)
+        completed = []
+
+        # questions are parsed while the draft streams in, the last possibly once it has ended
+        for start in range(0, len(text), 5):
+            completed.append(len(stream.feed(text[start:start + 5])))
+
+        stream.close()
+
+        assert stream.questions == converted
+        assert sum(completed) >= len(converted) - 1
+
+
+def test_stream_keeps_multiline_answers():
+    draft = "Question: What happens?\nCorrect answer: It compiles\nIncorrect answer: It panics\nIncorrect answer: It loops\nIncorrect answer: The program fails:\n```\nerror[E0382]\n```\n"
+    stream = QuestionStream(PromptType.MCQ, OutputFormat.TEMPLATE)
+
+    # the last question could still be going on when its first answer line ends
+    for line in draft.splitlines(keepends=True):
+        assert stream.feed(line) == []
+
+    assert stream.close()[0]["incorrect"][-1:] == ["The program fails:\n```\nerror[E0382]\n```"]
+
+
+def test_long_drafts_are_converted_in_parts(monkeypatch):
+    requests = []
+
+    async def acreate(messages, max_tokens, **kwargs):
+        requests.append(count_message_tokens(messages, "cl100k_base") + max_tokens)
+        draft = messages[-1]["content"]
+        questions = [{ "question": block.strip(), "follow-up": "Why?" } for block in split_questions(draft)]
+
+        return { "choices": [{ "message": { "content": json.dumps(questions) } }] }
+
+    monkeypatch.setattr(openai.ChatCompletion, "acreate", acreate)
+
+    # 15 long questions don't fit in one conversion with their JSON
+    num_questions = 15
+    draft = "".join(f"Question: {index} {'word ' * 150}\nFollow-up: Why?\n" for index in range(num_questions))
+    converted = asyncio.run(postprocess_with_gpt_async(draft, PromptType.OPEN_ENDED, num_questions))
+
+    assert len(converted) == num_questions
+    assert len(requests) > 1 and max(requests) <= MODEL_PROFILES[JSON_MODEL].context_window
+    assert conversion_capacity(PromptType.OPEN_ENDED) < num_questions
@@ -1,8 +1,16 @@
-from quizicist.prompt import Prompt, PromptType
+from quizicist.prompt import OUTPUT_FORMATS, OutputFormat, Prompt, PromptType
 
 def test_prompt():
     for prompt_type in [PromptType.MCQ, PromptType.OPEN_ENDED]:
         prompt = Prompt(prompt_type=prompt_type)
         prompt.add_system_prompt()
         prompt.add_message(role="user", content="hello world")
-        assert len(prompt.messages) == 2
\ No newline at end of file
+        assert len(prompt.messages) == 2
+
+
+def test_json_prompt():
+    prompt = Prompt(prompt_type=PromptType.MCQ, num_questions=3, output_format=OutputFormat.JSON).add_system_prompt()
+
+    assert prompt.output_format == OutputFormat.JSON
+    assert "JSON array of 3 objects" in prompt.messages[0]["content"]
+    assert Prompt(prompt_type=PromptType.MCQ).output_format == OUTPUT_FORMATS[PromptType.MCQ]
@@ -0,0 +1,127 @@
+import asyncio
+import time
+import openai
+import pytest
+from quizicist import response_cache
+from quizicist.response_cache import ResponseCache, ResponseCacheMissError
+from quizicist.retry import RetryBudget
+
+REQUEST = { "model": "gpt-4", "messages": [{ "role": "user", "content": "hello" }], "max_tokens": 10, "temperature": 0.8 }
+
+
+def fake_api(monkeypatch):
+    requests = []
+
+    async def acreate(**kwargs):
+        requests.append(kwargs)
+        return { "choices": [{ "message": { "content": f"response {len(requests)}" } }], "usage": { "total_tokens": 10 } }
+
+    monkeypatch.setattr(openai.ChatCompletion, "acreate", acreate)
+    return requests
+
+
+def use_cache(monkeypatch, tmp_path, mode, **kwargs):
+    cache = ResponseCache(str(tmp_path.joinpath("responses.sqlite3")), mode, **kwargs)
+    monkeypatch.setattr(response_cache, "response_cache", cache)
+    return cache
+
+
+def create(**kwargs):
+    completion = asyncio.run(RetryBudget().create(0, **dict(REQUEST, **kwargs)))
+    return completion["choices"][0]["message"]["content"]
+
+
+def test_readwrite(monkeypatch, tmp_path):
+    requests = fake_api(monkeypatch)
+    use_cache(monkeypatch, tmp_path, "readwrite")
+
+    assert create() == create() == "response 1"
+
+    # sampling parameters are part of the key
+    assert create(temperature=0) == "response 2"
+    assert len(requests) == 2
+
+
+def test_retries_get_new_responses(monkeypatch, tmp_path):
+    requests = fake_api(monkeypatch)
+    use_cache(monkeypatch, tmp_path, "readwrite")
+
+    async def create_twice():
+        budget = RetryBudget()
+        return [(await budget.create(0, **REQUEST))["choices"][0]["message"]["content"] for _ in range(2)]
+
+    # repeating a call within a request (eg. after unusable output) isn't answered with the same response,
+    # while a later request replays both
+    assert asyncio.run(create_twice()) == ["response 1", "response 2"]
+    assert asyncio.run(create_twice()) == ["response 1", "response 2"]
+    assert len(requests) == 2
+
+
+def test_record_and_replay(monkeypatch, tmp_path):
+    requests = fake_api(monkeypatch)
+
+    use_cache(monkeypatch, tmp_path, "record")
+    assert create() == "response 1"
+    assert create() == "response 2"
+
+    # replays the latest recording without calling the API, and never calls it on a miss
+    use_cache(monkeypatch, tmp_path, "replay", ttl=0)
+    assert create() == "response 2"
+    with pytest.raises(ResponseCacheMissError):
+        create(temperature=0)
+
+    assert len(requests) == 2
+
+
+def test_eviction(monkeypatch, tmp_path):
+    fake_api(monkeypatch)
+    cache = use_cache(monkeypatch, tmp_path, "readwrite", max_bytes=200)
+
+    create(temperature=0)
+    create(temperature=1)
+    create(temperature=0)
+    create(temperature=2)
+
+    # the least recently used response is evicted once responses outgrow the cache
+    assert cache.get(dict(REQUEST, temperature=0)) is not None
+    assert cache.get(dict(REQUEST, temperature=1)) is None
+
+    cache.ttl = 0
+    time.sleep(0.01)
+    assert cache.get(dict(REQUEST, temperature=0)) is None
+
+
+def test_streams_are_recorded(monkeypatch, tmp_path):
+    use_cache(monkeypatch, tmp_path, "readwrite")
+    calls = []
+
+    async def acreate(**kwargs):
+        calls.append(kwargs)
+
+        async def chunks():
+            for word in ["one ", "two ", "three"]:
+                yield { "choices": [{ "index": 0, "delta": { "content": word } }] }
+
+        return chunks()
+
+    async def read(words=None):
+        text = ""
+        chunks = await RetryBudget().create(0, stream=True, **REQUEST)
+
+        async for chunk in chunks:
+            text += chunk["choices"][0]["delta"]["content"]
+            if len(text.split()) == words:
+                break
+
+        await chunks.aclose()
+        return text
+
+    monkeypatch.setattr(openai.ChatCompletion, "acreate", acreate)
+
+    # streams closed before they end aren't recorded, complete streams are
+    assert asyncio.run(read(2)) == "one two "
+    assert asyncio.run(read()) == "one two three"
+    assert len(calls) == 2
+
+    monkeypatch.setattr(openai.ChatCompletion, "acreate", None)
+    assert asyncio.run(read()) == "one two three"
@@ -0,0 +1,254 @@
+import asyncio
+import json
+import openai
+import pytest
+from quizicist import completion
+from quizicist.prompt import OutputFormat, PromptType
+from quizicist.retry import FailureRates, RetryBudget, RetryBudgetExceededError, RetryPolicy
+
+POLICY = RetryPolicy(max_attempts=3, base_delay=0, token_budget=1000, time_budget=60)
+QUESTIONS = [{ "question": f"{index}?", "correct": "a", "incorrect": ["b", "c", "d"] } for index in range(5)]
+
+
+def response(content, tokens=100):
+    return { "choices": [{ "message": { "content": content } }], "usage": { "total_tokens": tokens } }
+
+
+@pytest.fixture(autouse=True)
+def failure_rates(monkeypatch):
+    rates = FailureRates()
+    monkeypatch.setattr(completion, "failure_rates", rates)
+    return rates
+
+
+def template_draft(indices):
+    return "\n\n".join(
+        f"Question: {index}?\nCorrect answer: a\nIncorrect answer: b\nIncorrect answer: c\nIncorrect answer: d"
+        for index in indices
+    )
+
+
+# a response as the API sends it, split into chunks of each choice's content when streamed
+def serve(result, stream=False):
+    if not stream:
+        return result
+
+    async def chunks():
+        for index, choice in enumerate(result["choices"]):
+            content = choice["message"]["content"]
+
+            for start in range(0, len(content), 8):
+                yield { "choices": [{ "index": index, "delta": { "content": content[start:start + 8] } }] }
+
+    return chunks()
+
+
+def fake_api(monkeypatch, responses):
+    async def acreate(**kwargs):
+        result = responses.pop(0)
+        if isinstance(result, Exception):
+            raise result
+
+        return serve(result, kwargs.get("stream"))
+
+    monkeypatch.setattr(openai.ChatCompletion, "acreate", acreate)
+
+
+def test_transient_errors_are_retried(monkeypatch):
+    fake_api(monkeypatch, [openai.error.RateLimitError("busy"), response("ok")])
+    budget = RetryBudget(POLICY)
+
+    completion = asyncio.run(budget.create(0, model="gpt-4", max_tokens=10))
+
+    assert completion["choices"][0]["message"]["content"] == "ok"
+    assert budget.stats()["retries"] == 1
+    assert budget.stats()["tokens"] == 100
+
+
+def test_unusable_output_is_bounded(monkeypatch, failure_rates):
+    # every draft converts to the wrong number of questions
+    attempt = [response("questions")] + [response("[]")] * POLICY.conversion_attempts
+    fake_api(monkeypatch, attempt * POLICY.max_attempts)
+    budget = RetryBudget(POLICY)
+
+    with pytest.raises(RetryBudgetExceededError):
+        asyncio.run(completion.run_gpt3_async("shard", 5, None, PromptType.MCQ, budget=budget, stream=False))
+
+    assert budget.calls == len(attempt) * POLICY.max_attempts
+    assert budget.wasted_tokens == budget.tokens == 900
+    assert [draft["converted"] for draft in budget.drafts] == [False] * POLICY.max_attempts
+    assert failure_rates.rate(PromptType.MCQ) > 0
+
+
+def test_failed_conversion_keeps_draft(monkeypatch, failure_rates):
+    questions = json.dumps(QUESTIONS)
+    fake_api(monkeypatch, [response("questions"), response("not json"), response(questions)])
+    budget = RetryBudget(POLICY)
+
+    result = asyncio.run(completion.run_gpt3_async("shard", 5, None, PromptType.MCQ, budget=budget, stream=False))
+
+    # only the conversion is retried, the draft is generated once
+    assert len(result) == 5
+    assert budget.calls == 3
+    assert budget.wasted_tokens == 100
+    assert budget.drafts == [{ "content": "questions", "prompt_type": PromptType.MCQ, "num_questions": 5, "converted": True }]
+
+    # drafts that only convert don't raise the failure rate, so no extra candidates are requested
+    assert failure_rates.rate(PromptType.MCQ) == 0
+
+
+def test_token_budget(monkeypatch):
+    fake_api(monkeypatch, [response("questions", tokens=1000)])
+    budget = RetryBudget(POLICY)
+
+    with pytest.raises(RetryBudgetExceededError):
+        asyncio.run(completion.run_gpt3_async("shard", 5, None, PromptType.MCQ, budget=budget, stream=False))
+
+    assert budget.calls == 1
+
+
+def test_template_draft_skips_conversion(monkeypatch):
+    fake_api(monkeypatch, [response(template_draft(range(5)))])
+    budget = RetryBudget(POLICY)
+
+    result = asyncio.run(completion.run_gpt3_async("shard", 5, None, PromptType.MCQ, budget=budget))
+
+    # parsed locally, without a round trip to the JSON model
+    assert [question["question"] for question in result] == ["0?", "1?", "2?", "3?", "4?"]
+    assert budget.calls == 1
+
+
+def test_json_output_format(monkeypatch):
+    requests = []
+
+    async def acreate(**kwargs):
+        requests.append(kwargs)
+        return serve(response(json.dumps(QUESTIONS)), kwargs.get("stream"))
+
+    monkeypatch.setattr(openai.ChatCompletion, "acreate", acreate)
+    budget = RetryBudget(POLICY)
+
+    result = asyncio.run(completion.run_gpt3_async("shard", 5, None, PromptType.MCQ, budget=budget, output_format=OutputFormat.JSON))
+
+    assert result == QUESTIONS
+    assert budget.calls == 1
+    assert "JSON array" in requests[0]["messages"][0]["content"]
+
+
+def test_short_batch_is_topped_up(monkeypatch):
+    requests = []
+    responses = [response(template_draft(range(3))), response("[]"), response("[]"), response(template_draft([3, 4]))]
+
+    async def acreate(**kwargs):
+        requests.append(kwargs)
+        return serve(responses.pop(0), kwargs.get("stream"))
+
+    monkeypatch.setattr(openai.ChatCompletion, "acreate", acreate)
+    budget = RetryBudget(POLICY)
+
+    result = asyncio.run(completion.run_gpt3_async("shard", 5, None, PromptType.MCQ, budget=budget))
+
+    # the follow-up asks only for the missing questions, listing the ones kept
+    assert [question["question"] for question in result] == ["0?", "1?", "2?", "3?", "4?"]
+    assert budget.top_ups == 1
+    assert "2 questions" in requests[-1]["messages"][0]["content"]
+    assert "- 0?" in requests[-1]["messages"][-1]["content"]
+
+
+def test_extra_questions_are_trimmed(monkeypatch):
+    fake_api(monkeypatch, [response(template_draft(range(7)))])
+    budget = RetryBudget(POLICY)
+
+    result = asyncio.run(completion.run_gpt3_async("shard", 5, None, PromptType.MCQ, budget=budget))
+
+    assert len(result) == 5
+    assert budget.calls == 1
+
+
+def test_candidates_follow_failure_rate(failure_rates):
+    assert failure_rates.candidates(PromptType.MCQ, POLICY) == 1
+
+    for _ in range(10):
+        failure_rates.record(PromptType.MCQ, True)
+
+    # a 0.65 failure rate needs 7 candidates to stay under 5%, capped by the policy
+    assert failure_rates.candidates(PromptType.MCQ, POLICY) == 3
+    assert failure_rates.candidates(PromptType.MCQ, RetryPolicy(max_candidates=2)) == 2
+    assert failure_rates.candidates(PromptType.OPEN_ENDED, POLICY) == 1
+
+
+def test_candidates_fill_reserve(monkeypatch, failure_rates):
+    failure_rates.rates[PromptType.MCQ] = 0.5
+    requests = []
+
+    async def acreate(**kwargs):
+        requests.append(kwargs)
+        drafts = ["questions", template_draft(range(5)), template_draft(range(5, 10))]
+        return serve({ "choices": [{ "message": { "content": draft } } for draft in drafts] }, kwargs.get("stream"))
+
+    monkeypatch.setattr(openai.ChatCompletion, "acreate", acreate)
+    budget = RetryBudget(POLICY)
+
+    first = asyncio.run(completion.run_gpt3_async("shard", 5, None, PromptType.MCQ, budget=budget))
+    second = asyncio.run(completion.run_gpt3_async("shard", 5, None, PromptType.MCQ, budget=budget))
+
+    # the first candidate that parses is used, and the job on the same shard draws on the reserve
+    assert [question["question"] for question in first] == ["0?", "1?", "2?", "3?", "4?"]
+    assert [question["question"] for question in second] == ["5?", "6?", "7?", "8?", "9?"]
+    assert [request["n"] for request in requests] == [3]
+    assert [draft["converted"] for draft in budget.drafts] == [False, True, True]
+
+
+def test_stream_closes_once_questions_are_parsed(monkeypatch):
+    draft = template_draft(range(8))
+    read = []
+    closed = []
+
+    async def acreate(**kwargs):
+        async def chunks():
+            try:
+                for start in range(0, len(draft), 8):
+                    read.append(start)
+                    yield { "choices": [{ "index": 0, "delta": { "content": draft[start:start + 8] } }] }
+            finally:
+                closed.append(True)
+
+        return chunks()
+
+    monkeypatch.setattr(openai.ChatCompletion, "acreate", acreate)
+    surfaced = []
+
+    result = asyncio.run(completion.run_gpt3_async("shard", 5, None, PromptType.MCQ, budget=RetryBudget(POLICY), on_question=surfaced.append))
+
+    # questions are surfaced as they're parsed, and the rest of the draft is never read
+    assert surfaced == result
+    assert [question["question"] for question in result] == ["0?", "1?", "2?", "3?", "4?"]
+    assert closed == [True]
+    assert len(read) * 8 < draft.index("Question: 6?")
+
+
+def test_interrupted_stream_keeps_questions(monkeypatch):
+    draft = template_draft(range(4))
+    responses = [draft, template_draft([3, 4])]
+
+    async def acreate(**kwargs):
+        content = responses.pop(0)
+
+        async def chunks():
+            for start in range(0, len(content), 8):
+                yield { "choices": [{ "index": 0, "delta": { "content": content[start:start + 8] } }] }
+
+            # the first stream breaks off partway through its last question
+            if content == draft:
+                raise openai.error.APIError("connection reset")
+
+        return chunks()
+
+    monkeypatch.setattr(openai.ChatCompletion, "acreate", acreate)
+    budget = RetryBudget(POLICY)
+
+    result = asyncio.run(completion.run_gpt3_async("shard", 5, None, PromptType.MCQ, budget=budget))
+
+    assert [question["question"] for question in result] == ["0?", "1?", "2?", "3?", "4?"]
+    assert budget.calls == 2
+    assert budget.stats()["retries"] == 1
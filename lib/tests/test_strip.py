@@ -0,0 +1,47 @@
+import pathlib
+import re
+import mistletoe
+import pytest
+from mistletoe.ast_renderer import ASTRenderer
+from quizicist.consts import TOP_LEVEL_COMPONENTS
+from quizicist.parsers.md import component_is_valid, find_component_text, resolve_include, token_type
+from quizicist.parsers.strip import strip_html
+
+bs4 = pytest.importorskip("bs4")
+
+EXPERIMENTS_DIR = pathlib.Path(__file__).parents[2].joinpath("experiments")
+
+
+# previous text extraction, building a BeautifulSoup tree at every level of the AST
+def reference_component_text(component):
+    text = []
+
+    for child in component.children:
+        if token_type(child) == "RawText":
+            text.append(re.sub(r'{{(.*?)}}', resolve_include, child.content))
+        elif token_type(child) == "LineBreak":
+            text.append(" ")
+        elif hasattr(child, "children"):
+            text.append(reference_component_text(child))
+
+    if token_type(component) in TOP_LEVEL_COMPONENTS:
+        text.append("\n")
+
+    return bs4.BeautifulSoup("".join(text), "lxml").text
+
+
+@pytest.mark.filterwarnings("ignore::bs4.MarkupResemblesLocatorWarning")
+def test_strip_html():
+    for text in ["  hello", "\n\n", "Vec<String>\n", "a < b", "x<y>z</y>w", "<!-- c --> <a id='x'></a>\n",
+                 "&amp;lt; &lt; &nbsp;x &#65;", "<script>bad()</script>y", "<body> <button>Click</button>"]:
+        assert strip_html(text) == bs4.BeautifulSoup(text, "lxml").text
+
+
+@pytest.mark.filterwarnings("ignore::bs4.MarkupResemblesLocatorWarning")
+def test_strip_html_parity():
+    for path in EXPERIMENTS_DIR.glob("**/*.md"):
+        with ASTRenderer():
+            document = mistletoe.Document(path.read_text())
+
+        for component in filter(component_is_valid, document.children):
+            assert find_component_text(component) == reference_component_text(component), path.name
@@ -0,0 +1,118 @@
+import io
+import pathlib
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from quizicist import tokens
+from quizicist.parsers.md import md_parser
+from quizicist.parsers.text import parse_text
+from quizicist.tokens import count_tokens
+
+EXPERIMENTS_DIR = pathlib.Path(__file__).parents[2].joinpath("experiments")
+
+# token counts produced by `GPT2Tokenizer.from_pretrained("gpt2")`
+GPT2_COUNTS = {
+    "": 0,
+    "hello world": 2,
+    "a<|endoftext|>b": 3,
+    "fn longest<'a>(x: &'a str) -> &'a str {": 19,
+    "    \n\n": 5,
+    "héllo wörld 日本語 🙂": 14,
+}
+
+# token counts produced by `tiktoken.get_encoding("cl100k_base")`
+CL100K_COUNTS = {
+    "": 0,
+    "hello world": 2,
+    "a<|endoftext|>b": 3,
+    "fn longest<'a>(x: &'a str) -> &'a str {": 16,
+    "    \n\n": 1,
+    "héllo wörld 日本語 🙂": 11,
+}
+
+
+# pieces and total tokens of each experiment chapter's components and lines, produced by `tiktoken.get_encoding("cl100k_base")`
+CL100K_CHAPTER_COUNTS = {
+    "edit-mode-to-json/lifetimes-malformatted-0.md": (148, 2756),
+    "edit-mode-to-json/lifetimes-well-formatted-0.md": (202, 3092),
+    "edit-mode-to-json/lifetimes-well-formatted-1.md": (189, 3354),
+    "hand-scoring/003/tests/main-idea.md": (238, 7102),
+    "hand-scoring/README.md": (31, 251),
+    "plai/algebraic-types.md": (158, 3385),
+    "plai/control-on-web.md": (446, 8556),
+    "plai/evaluation-on-paper.md": (207, 4278),
+    "plai/generators.md": (281, 4332),
+    "plai/intro-to-objects.md": (484, 8842),
+    "plai/nominal-structural-subtype.md": (249, 4453),
+    "plai/parsing.md": (389, 4146),
+    "plai/representing-arithmetic.md": (175, 3499),
+    "plai/smol-reactivity.md": (258, 5164),
+    "plai/smol.md": (711, 14847),
+    "plai/union-and-retrofitted-types.md": (400, 10186),
+    "prompt-bank/test-files/lifetimes.md": (739, 12404),
+    "prompt-bank/test-files/traits.md": (462, 7390),
+}
+
+
+# texts counted when a chapter is uploaded, as markdown components and as lines of text
+def chapter_texts(path):
+    chapter = path.read_text()
+
+    texts = [component["text"] for component in md_parser(chapter)]
+    texts += [chunk["text"] for chunk in parse_text(io.StringIO(chapter))]
+
+    return texts
+
+
+def test_bpe_counts():
+    for encoding, known_counts in [("gpt2", GPT2_COUNTS), ("cl100k_base", CL100K_COUNTS)]:
+        texts = list(known_counts.keys())
+        assert count_tokens(texts, encoding, counter="bpe") == list(known_counts.values())
+
+
+def test_counts_with_shared_cache(monkeypatch):
+    # a tiny cache is cleared by one thread while others are reading it
+    monkeypatch.setattr(tokens, "TOKEN_CACHE_SIZE", 4)
+    texts = [f"text {index} " * (index % 5 + 1) for index in range(200)]
+    expected = count_tokens(texts, "cl100k_base", counter="bpe")
+
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(lambda offset: count_tokens(texts[offset:] + texts[:offset], "cl100k_base", counter="bpe"), range(0, 200, 5)))
+
+    for offset, result in zip(range(0, 200, 5), results):
+        assert result == expected[offset:] + expected[:offset]
+
+
+def test_bpe_parity():
+    transformers = pytest.importorskip("transformers")
+
+    try:
+        reference = transformers.GPT2Tokenizer.from_pretrained("gpt2")
+    except OSError:
+        pytest.skip("GPT-2 vocabulary unavailable offline")
+
+    for path in EXPERIMENTS_DIR.glob("**/*.md"):
+        texts = chapter_texts(path)
+
+        expected = [len(reference(text)["input_ids"]) for text in texts]
+        assert count_tokens(texts, "gpt2", counter="bpe") == expected, path.name
+
+
+def test_cl100k_corpus_counts():
+    for name, (pieces, total) in CL100K_CHAPTER_COUNTS.items():
+        texts = chapter_texts(EXPERIMENTS_DIR.joinpath(name))
+        assert (len(texts), sum(count_tokens(texts, "cl100k_base", counter="bpe"))) == (pieces, total), name
+
+
+def test_cl100k_parity():
+    tiktoken = pytest.importorskip("tiktoken")
+
+    try:
+        reference = tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        pytest.skip("cl100k_base vocabulary unavailable offline")
+
+    for name in CL100K_CHAPTER_COUNTS:
+        texts = chapter_texts(EXPERIMENTS_DIR.joinpath(name))
+
+        expected = [len(reference.encode(text, disallowed_special=())) for text in texts]
+        assert count_tokens(texts, "cl100k_base", counter="bpe") == expected, name
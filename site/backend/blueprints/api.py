@@ -1,12 +1,15 @@
-from flask import Blueprint, jsonify, request
+import time
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
 from flask_login import current_user
-from quizicist.errors import QuizicistError
+from quizicist.errors import ExecutorSaturatedError, QuizicistError
 from ..lib.consts import ExportTypes, ModelTypes
+from ..lib.errors import OPENAI_ERROR_MESSAGES, JobInProgressError
 from ..lib.export import GoogleFormExport
 from ..lib.files import create_file_from_json
 from ..lib.mdbook import questions_to_toml
-from ..models import AnswerChoice, Export, Generation, Question, Message
+from ..models import AnswerChoice, Export, Generation, GenerationJob, Question, Message
 from ..db import db
+from ..jobs import jobs
 from ..limiter import limiter
 import openai.error as OpenAIError
 
@@ -56,14 +59,14 @@ def upload():
     # conditionally retrieve custom prompt from request
     custom_prompt = None if not request.json["is_custom_prompt"] else request.json["custom_prompt"]
 
-    # run completion, add generated questions to database
-    generation.add_questions(num_questions, custom_prompt)
-
-    db.session.commit()
+    # generate questions in the background, the client follows the job for progress
+    job = jobs.submit(generation, num_questions, custom_prompt)
 
     return {
-        "message": f"Completed generation for {filename}"
-    }
+        "message": f"Started generation for {filename}",
+        "generation": generation.id,
+        "job": job.id,
+    }, 202
 
 
 # return all generations as JSON
@@ -118,12 +121,92 @@ def generate_more(generation_id):
     if num_questions > 10 or num_questions < 1:
         return "Invalid number of questions", 400
 
-    # run completion, add generated questions to database
-    generation.add_questions(num_questions)
+    # generate questions in the background, the client follows the job for progress
+    job = jobs.submit(generation, num_questions)
 
     return {
-        "message": f"Added questions for {generation.filename}"
-    }
+        "message": f"Adding questions for {generation.filename}",
+        "generation": generation.id,
+        "job": job.id,
+    }, 202
+
+
+# return a generation job's status and progress as JSON
+@api.route("/jobs/<job_id>")
+def get_job(job_id):
+    job: GenerationJob = db.get_or_404(GenerationJob, job_id)
+    job.check_ownership(current_user.id)
+    job.fail_if_stale()
+
+    return jsonify(job)
+
+
+# seconds between checks for a job's new questions, and between keep-alive comments on a quiet stream
+JOB_EVENTS_POLL_INTERVAL = 0.5
+JOB_EVENTS_KEEPALIVE = 15
+
+
+# format a server-sent event, with `data` serialized as JSON
+def sse_event(event, data, event_id=None):
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {current_app.json.dumps(data)}")
+
+    return "\n".join(lines) + "\n\n"
+
+
+# stream a generation job's questions as each shard is saved, as server-sent events
+# sends "question" for each new question, "progress" when shard progress changes, and "done" with the finished job
+# polls the database, sleeping between checks so gevent workers serve other requests
+@api.route("/jobs/<job_id>/events")
+def job_events(job_id):
+    job: GenerationJob = db.get_or_404(GenerationJob, job_id)
+    job.check_ownership(current_user.id)
+
+    # reconnecting browsers send the id of the last question they received
+    last_event_id = request.headers.get("Last-Event-ID", type=int)
+
+    def events():
+        last_question_id = last_event_id
+        last_progress = None
+        last_sent = time.monotonic()
+
+        while True:
+            job: GenerationJob = db.session.get(GenerationJob, job_id)
+            job.fail_if_stale()
+            finished = job.finished()
+            sent = False
+
+            for question in job.questions_after(last_question_id):
+                yield sse_event("question", question, question.id)
+                last_question_id = question.id
+                sent = True
+
+            if job.shard_progress != last_progress:
+                yield sse_event("progress", job)
+                last_progress = job.shard_progress
+                sent = True
+
+            if finished:
+                yield sse_event("done", job)
+                return
+
+            if sent:
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= JOB_EVENTS_KEEPALIVE:
+                yield ": keep-alive\n\n"
+                last_sent = time.monotonic()
+
+            # return the connection between checks, and see the job's latest commits on the next one
+            db.session.close()
+            time.sleep(JOB_EVENTS_POLL_INTERVAL)
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        # stop reverse proxies from buffering events
+        "X-Accel-Buffering": "no",
+    })
 
 
 # delete a generation
@@ -184,13 +267,16 @@ def new_item(generation_id):
     generation: Generation = db.get_or_404(Generation, generation_id)
     generation.check_ownership(current_user.id)
 
+    # placed after the quiz's questions under the same lock as generated questions, rather than through `OrderingList`
     question = Question(
+        generation_id=generation.id,
         question=request.json["question"],
         original_question=request.json["question"],
         is_custom_question=True,
         shard=0, # TODO: this should probably not default to the first shard
+        position=generation.next_position(),
     )
-    generation.questions.append(question)
+    db.session.add(question)
     db.session.commit()
 
     # add answer choices
@@ -334,20 +420,22 @@ def download_toml(generation_id):
 def handle_quizicist_error(e):
     return { "message": str(e) }, 500
 
+@api.errorhandler(ExecutorSaturatedError)
+def handle_executor_saturated(e):
+    return { "message": str(e) }, 503
+
+@api.errorhandler(JobInProgressError)
+def handle_job_in_progress(e):
+    return { "message": str(e) }, 409
+
 @api.errorhandler(OpenAIError.ServiceUnavailableError)
 def handle_service_unavailable(_):
-    return {
-        "message": "OpenAI is experiencing server issues. Please wait a few minutes and try again."
-    }, 500
+    return { "message": OPENAI_ERROR_MESSAGES[OpenAIError.ServiceUnavailableError] }, 500
 
 @api.errorhandler(OpenAIError.RateLimitError)
 def handle_rate_limit(_):
-    return {
-        "message": "We're currently experiencing high demand. Please wait a few minutes and try again."
-    }, 500
+    return { "message": OPENAI_ERROR_MESSAGES[OpenAIError.RateLimitError] }, 500
 
 @api.errorhandler(OpenAIError.Timeout)
 def handle_timeout(_):
-    return {
-        "message": "OpenAI took too long to respond. Please try again. If the error is not resolved, please submit feedback detailing your error."
-    }, 500
+    return { "message": OPENAI_ERROR_MESSAGES[OpenAIError.Timeout] }, 500
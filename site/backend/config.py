@@ -1,7 +1,10 @@
 import os
+from quizicist.governor import RateLimit
+from quizicist.prompt import OutputFormat
 
 APP_FOLDER = os.path.dirname(os.path.realpath(__file__))
 UPLOAD_FOLDER = os.path.join(APP_FOLDER, "uploads")
+PARSED_CONTENT_FOLDER = os.path.join(UPLOAD_FOLDER, "parsed")
 
 MYSQL_USERNAME = os.getenv("MYSQL_USERNAME")
 MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD")
@@ -14,6 +17,9 @@ class Config(object):
     # folder for markdown file uploads
     UPLOAD_FOLDER = UPLOAD_FOLDER
 
+    # folder for parsed components and shards, keyed by upload hash
+    PARSED_CONTENT_FOLDER = PARSED_CONTENT_FOLDER
+
     # secure secret key loaded from .env
     SECRET_KEY = os.environ.get("FLASK_SECRET", "UNSAFE_DEBUG_SECRET")
     FLASK_SECRET = SECRET_KEY
@@ -21,6 +27,27 @@ class Config(object):
     # allow Content-Type header cross-origin
     CORS_HEADERS = "Content-Type"
 
+    # threads per worker process generating questions in the background
+    GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", "4"))
+
+    # format questions are generated in, the prompt type's default format when unset
+    OUTPUT_FORMAT = OutputFormat[os.environ["OUTPUT_FORMAT"]] if os.getenv("OUTPUT_FORMAT") else None
+
+    # seconds a running generation job may go without a heartbeat before it's treated as interrupted
+    GENERATION_JOB_LEASE = int(os.getenv("GENERATION_JOB_LEASE", "90"))
+
+    # OpenAI account limits, shared by all workers through the rate limit storage
+    OPENAI_RATE_LIMITS = {
+        "gpt-4": RateLimit(
+            requests_per_minute=int(os.getenv("GPT4_REQUESTS_PER_MINUTE", "200")),
+            tokens_per_minute=int(os.getenv("GPT4_TOKENS_PER_MINUTE", "40000")),
+        ),
+        "gpt-3.5-turbo": RateLimit(
+            requests_per_minute=int(os.getenv("GPT35_REQUESTS_PER_MINUTE", "3500")),
+            tokens_per_minute=int(os.getenv("GPT35_TOKENS_PER_MINUTE", "90000")),
+        ),
+    }
+
 
 # for use in local development
 class DebugConfig(Config):
@@ -0,0 +1,71 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from quizicist.completion import shard_jobs
+from quizicist.executor import get_executor
+from .db import db
+from .lib.consts import JobStatus
+from .lib.errors import JobInProgressError
+from .models import Generation, GenerationJob
+
+
+# runs generation jobs on background threads of each web worker, without an external broker
+# jobs are claimed in the database, so a job submitted in several processes still runs once
+class JobQueue:
+    def __init__(self):
+        self.app = None
+        self.pool = None
+        self.pool_pid = None
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+
+    # threads don't survive a fork, so each worker process starts its own pool
+    def get_pool(self) -> ThreadPoolExecutor:
+        with self.lock:
+            if self.pool_pid != os.getpid():
+                self.pool = ThreadPoolExecutor(self.app.config["GENERATION_WORKERS"], thread_name_prefix="generation-job")
+                self.pool_pid = os.getpid()
+
+            return self.pool
+
+    def enqueue(self, job_id):
+        self.get_pool().submit(self.run, job_id)
+
+    # create and queue a job adding questions to `generation`, committing the session
+    # errors a job would only hit later (content too long, too much load, a job already running) are raised here instead
+    def submit(self, generation: Generation, num_questions, custom_prompt=None) -> GenerationJob:
+        shard_jobs(generation.content_shards, num_questions, custom_prompt)
+        get_executor().check_capacity()
+
+        # quizzes get one job at a time, the generation's row is locked until the new job is committed
+        if generation.id is not None:
+            db.session.execute(db.select(Generation.id).where(Generation.id == generation.id).with_for_update())
+
+            if GenerationJob.active(generation.id) is not None:
+                raise JobInProgressError("Questions are still being generated for this quiz. Please wait for them to finish.")
+
+        job = GenerationJob(num_questions=num_questions, custom_prompt=custom_prompt)
+        generation.jobs.append(job)
+        db.session.commit()
+
+        self.enqueue(job.id)
+        return job
+
+    # queue jobs left pending by workers that exited before starting them, and fail jobs they left running
+    def resume_pending(self):
+        GenerationJob.fail_stale_jobs()
+
+        for job in GenerationJob.query.filter_by(status=JobStatus.pending):
+            self.enqueue(job.id)
+
+    def run(self, job_id):
+        with self.app.app_context():
+            job = db.session.get(GenerationJob, job_id)
+
+            if job is not None and job.claim():
+                job.run()
+
+
+jobs = JobQueue()
@@ -16,3 +16,10 @@ class ExportTypes(enum.IntEnum):
 class ModelTypes(str, enum.Enum):
     gpt3 = 0
     gpt4 = 1
+
+# states of a background generation job
+class JobStatus(str, enum.Enum):
+    pending = "pending"
+    running = "running"
+    completed = "completed"
+    failed = "failed"
@@ -0,0 +1,30 @@
+import openai.error as OpenAIError
+from quizicist.errors import QuizicistError
+
+# messages shown to users for OpenAI errors raised while generating questions
+OPENAI_ERROR_MESSAGES = {
+    OpenAIError.ServiceUnavailableError: "OpenAI is experiencing server issues. Please wait a few minutes and try again.",
+    OpenAIError.RateLimitError: "We're currently experiencing high demand. Please wait a few minutes and try again.",
+    OpenAIError.Timeout: "OpenAI took too long to respond. Please try again. If the error is not resolved, please submit feedback detailing your error.",
+}
+
+INTERRUPTED_JOB_MESSAGE = "Question generation was interrupted. Please try again."
+
+UNKNOWN_ERROR_MESSAGE = "Something went wrong while generating your questions. Please try again. If the error is not resolved, please submit feedback detailing your error."
+
+
+# raised when asking for more questions while a quiz's questions are still being generated
+class JobInProgressError(QuizicistError):
+    pass
+
+
+# message shown to users for an error raised while generating questions
+def error_message(error: Exception) -> str:
+    if isinstance(error, QuizicistError):
+        return str(error)
+
+    for error_type, message in OPENAI_ERROR_MESSAGES.items():
+        if isinstance(error, error_type):
+            return message
+
+    return UNKNOWN_ERROR_MESSAGE
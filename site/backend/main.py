@@ -3,10 +3,12 @@ from pathlib import Path
 from flask import Flask
 from flask_cors import CORS
 from dotenv import load_dotenv
+from quizicist.governor import configure_governor
 from .blueprints.api import api
 from .blueprints.auth import auth, login_manager
 from .blueprints.admin import admin, bcrypt
 from .db import db, migrate
+from .jobs import jobs
 from .config import APP_FOLDER, ProductionConfig, DebugConfig
 from .limiter import limiter
 
@@ -24,6 +26,12 @@ migrate.init_app(app, db)
 # limit requests by IP
 limiter.init_app(app)
 
+# run question generation in the background of each worker
+jobs.init_app(app)
+
+# hold OpenAI calls from every worker within the account's rate limits
+configure_governor(app.config["OPENAI_RATE_LIMITS"], app.config["RATELIMIT_STORAGE_URI"])
+
 # initialize flask-login authentication
 login_manager.init_app(app)
 
@@ -42,3 +50,6 @@ app.register_blueprint(admin, url_prefix="/admin")
 def setup():
     # create directory for file uploads
     Path(os.path.join(APP_FOLDER, "uploads")).mkdir(exist_ok=True)
+
+    # pick up generation jobs that were never started
+    jobs.resume_pending()
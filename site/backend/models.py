@@ -1,16 +1,23 @@
 from __future__ import annotations
+import queue
+import threading
 from dataclasses import dataclass
+from datetime import datetime, timedelta
 from typing import List
 from .db import db
 from flask import current_app
 from flask_login import UserMixin
 from flask_sqlalchemy.query import Query
 from Levenshtein import distance
-from quizicist.completion import complete, add_answer_choices, chapter_tokens
+from quizicist.completion import add_answer_choices, complete_shards_iter, shard_jobs
+from quizicist.content import parse_content
 from quizicist.parsers.md import md_parser
 from quizicist.parsers.text import parse_text
+from quizicist.retry import RetryBudget
 from quizicist.consts import FeedbackTypes
-from .lib.consts import ExportTypes, MessageTypes, ModelTypes
+from quizicist.prompt import PromptType
+from .lib.consts import ExportTypes, JobStatus, MessageTypes, ModelTypes
+from .lib.errors import INTERRUPTED_JOB_MESSAGE, error_message
 import os
 from sqlalchemy.ext.hybrid import hybrid_property, hybrid_method
 from sqlalchemy.ext.orderinglist import OrderingList
@@ -122,9 +129,23 @@ class Generation(db.Model, UpdateMixin):
 
     exports: List[Export] = db.relationship(Export, backref="generation")
 
+    # raw model output, not serialized with the quiz
+    drafts = db.relationship("Draft", backref="generation", cascade="all, delete-orphan")
+
+    # background jobs adding questions to the quiz, not serialized with the quiz
+    jobs = db.relationship("GenerationJob", backref="generation", cascade="all, delete-orphan")
+
     # format of uploaded content
     content_type: str = db.Column(db.String(10), default="Markdown", nullable=False)
 
+    # repeated OpenAI calls and tokens spent on discarded output while generating this quiz
+    retries: int = db.Column(db.Integer, default=0, server_default="0", nullable=False)
+    wasted_tokens: int = db.Column(db.Integer, default=0, server_default="0", nullable=False)
+
+    # shards questions were generated from, kept with the quiz so `Question.shard` stays valid when parsing changes
+    # not serialized with the quiz
+    shards = db.Column(db.JSON, nullable=True)
+
     @hybrid_property
     def upload_path(cls):
         return os.path.join(current_app.config["UPLOAD_FOLDER"], cls.unique_filename)
@@ -166,14 +187,31 @@ class Generation(db.Model, UpdateMixin):
         first_export: Export = self.exports[0]
         return (first_export.created_at - self.created_at).total_seconds() / 60.0
 
+    # parsed components and shards of uploaded content, cached by content hash
     @hybrid_property
-    def content_tokens(self):
+    def parsed_content(self):
         parser = PARSERS[self.content_type]
 
         with open(self.upload_path) as upload:
-            parsed = parser(upload)
+            return parse_content(upload, parser, cache_dir=current_app.config["PARSED_CONTENT_FOLDER"])
+
+    # the quiz's shards, stored the first time they're needed
+    # quizzes created before shards were stored are sharded again, but their questions are left as they are,
+    # so their shards are only stored once `remap_shards.py` has matched the questions to them
+    @hybrid_property
+    def content_shards(self):
+        if self.shards is not None:
+            return self.shards
+
+        shards = self.parsed_content["shards"]
+        if not self.questions:
+            self.shards = shards
+
+        return shards
 
-        return chapter_tokens(parsed)
+    @hybrid_property
+    def content_tokens(self):
+        return self.parsed_content["tokens"]
 
     @hybrid_property
     def num_questions(self):
@@ -213,49 +251,88 @@ class Generation(db.Model, UpdateMixin):
 
         return feedback[0] * 100 / total
 
-    # TODO: remove need for parser
+    # `on_question` is called with each question's shard index and the question as it's generated
+    # each shard's questions are saved as soon as the shard finishes, without waiting for the others
+    # questions are marked with `job_id` when a background job adds them
     @hybrid_method
-    def add_questions(self, num_questions, custom_prompt=None):
-        parser = PARSERS[self.content_type]
-
+    def add_questions(self, num_questions, custom_prompt=None, on_question=None, job_id=None):
         # run gpt-3 completion
-        with open(self.upload_path) as upload:
-            shards = complete(upload, parser, num_questions, custom_prompt)
-
-        for shard, questions in enumerate(shards):
-            for question in questions:
-                q = Question(
-                    question=question["question"],
-                    original_question=question["question"],
-                    shard=shard,
-                )
-                self.questions.append(q)
-                db.session.commit()
-
-                # create correct answer choice
-                correct = AnswerChoice(
-                    text=question["correct"],
-                    original_text=question["correct"],
-                    predicted_feedback=FeedbackTypes.correct
-                )
-                q.answers.append(correct)
-
-                # create answer choices for incorrect choices
-                for incorrect in question["incorrect"]:
-                    distractor = AnswerChoice(
-                        text=incorrect,
-                        original_text=incorrect,
-                        predicted_feedback=FeedbackTypes.incorrect
-                    )
-                    q.answers.append(distractor)
-
-        # add distractors to db
+        budget = RetryBudget()
+        try:
+            output_format = current_app.config["OUTPUT_FORMAT"]
+            for shard, questions in complete_shards_iter(self.content_shards, num_questions, custom_prompt, budget=budget, on_question=on_question, output_format=output_format):
+                self.save_questions(shard, questions, job_id)
+        finally:
+            self.record_budget(budget)
+
+    # position after every question of the quiz, including soft-deleted ones, as `OrderingList` numbers them
+    # locks the quiz's row and questions until the transaction ends, so writers appending at once take different positions
+    @hybrid_method
+    def next_position(self):
+        db.session.execute(db.select(Generation.id).where(Generation.id == self.id).with_for_update())
+
+        positions = db.session.execute(
+            db.select(Question.position).where(Question.generation_id == self.id).with_for_update()
+        ).scalars().all()
+
+        return max([position for position in positions if position is not None], default=-1) + 1
+
+    # insert a shard's questions and answer choices in one transaction, with positions computed up front
+    # skips the ORM's unit of work and `OrderingList` renumbering, which cost a flush and commit per question
+    # questions are still inserted one row at a time, answer choices in a single executemany
+    @hybrid_method
+    def save_questions(self, shard, questions, job_id=None):
+        if not questions:
+            return
+
+        first_position = self.next_position()
+
+        rows = [
+            {
+                "generation_id": self.id,
+                "question": question["question"],
+                "original_question": question["question"],
+                "shard": shard,
+                "job_id": job_id,
+                "position": first_position + position,
+            }
+            for position, question in enumerate(questions)
+        ]
+
+        # fills in each row's id from its insert, so answer choices never depend on looking questions up again
+        # returning ids needs an INSERT per question, since a multi-row insert on MySQL only reports its first id
+        # and the default `innodb_autoinc_lock_mode=2` doesn't promise the rest follow on from it
+        db.session.bulk_insert_mappings(Question, rows, return_defaults=True)
+
+        answers = []
+        for row, question in zip(rows, questions):
+            # correct answer choice first, then incorrect choices
+            choices = [(question["correct"], FeedbackTypes.correct)]
+            choices += [(incorrect, FeedbackTypes.incorrect) for incorrect in question["incorrect"]]
+
+            answers += [
+                {
+                    "question_id": row["id"],
+                    "text": text,
+                    "original_text": text,
+                    "predicted_feedback": feedback,
+                    "position": answer_position,
+                }
+                for answer_position, (text, feedback) in enumerate(choices)
+            ]
+
+        db.session.execute(AnswerChoice.__table__.insert(), answers)
+
+        # add the shard's questions and answer choices together, so they're never seen without answers
         db.session.commit()
 
     @hybrid_method
     def add_answer_choices(self, question: Question):
-        with open(self.upload_path) as upload:
-            custom_output = add_answer_choices(upload, PARSERS[self.content_type], question)
+        budget = RetryBudget()
+        try:
+            custom_output = add_answer_choices(self.content_shards, question, budget)
+        finally:
+            self.record_budget(budget)
         
         for option in custom_output["options"]:
             choice = AnswerChoice(
@@ -267,6 +344,17 @@ class Generation(db.Model, UpdateMixin):
 
         db.session.commit()
 
+    # add a request's retries and drafts to the quiz, including requests that failed
+    @hybrid_method
+    def record_budget(self, budget: RetryBudget):
+        self.retries = (self.retries or 0) + budget.retries
+        self.wasted_tokens = (self.wasted_tokens or 0) + budget.wasted_tokens
+
+        for draft in budget.drafts:
+            self.drafts.append(Draft(**draft))
+
+        db.session.commit()
+
     @hybrid_method
     def check_ownership(self, user_id):
         if self.user_id != user_id:
@@ -305,6 +393,9 @@ class Question(db.Model, UpdateMixin):
     # shard of uploaded content used to generate question
     shard: int = db.Column(db.Integer, default=0)
 
+    # background job that generated the question, not serialized with the quiz
+    job_id = db.Column(db.Integer, db.ForeignKey("generation_job.id"), nullable=True)
+
     @hybrid_property
     def generation(self):
         return db.session.query(Generation).get(self.generation_id)
@@ -393,6 +484,188 @@ class AnswerChoice(db.Model, UpdateMixin):
             raise Unauthorized("User doesn't have access to this answer choice")
 
 
+# raw questions generated for a shard, kept so failed JSON conversions can be reprocessed offline
+class Draft(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    generation_id = db.Column(db.Integer, db.ForeignKey("generation.id"))
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+
+    # model output before conversion to JSON
+    content = db.Column(db.Text)
+
+    prompt_type = db.Column(db.Enum(PromptType))
+    num_questions = db.Column(db.Integer)
+
+    # whether the draft was converted to questions
+    converted = db.Column(db.Boolean(), default=False, nullable=False)
+
+    # questions converted offline by `reprocess_drafts.py`, kept with the draft instead of being added to the quiz
+    questions = db.Column(db.JSON, nullable=True)
+
+
+# questions being added to a quiz in the background, outside of the request that asked for them
+@dataclass
+class GenerationJob(db.Model):
+    __tablename__ = "generation_job"
+
+    id: int = db.Column(db.Integer, primary_key=True)
+    generation_id: int = db.Column(db.Integer, db.ForeignKey("generation.id"))
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+
+    status: JobStatus = db.Column(db.Enum(JobStatus), default=JobStatus.pending, nullable=False)
+
+    # questions requested, and instructions to generate them with
+    num_questions: int = db.Column(db.Integer, nullable=False)
+    custom_prompt = db.Column(db.Text, nullable=True)
+
+    # questions planned and generated so far for each shard of the quiz's content, empty until the job starts
+    shard_questions: List[int] = db.Column(db.JSON, default=list)
+    shard_progress: List[int] = db.Column(db.JSON, default=list)
+
+    # message for the user when the job fails
+    error: str = db.Column(db.String(ITEM_LENGTH), nullable=True)
+
+    # last time (UTC) the worker running the job showed it was alive
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+
+    # mark the job as running, False if another worker already claimed it
+    @hybrid_method
+    def claim(self):
+        table = GenerationJob.__table__
+        claimed = db.session.execute(
+            table.update()
+                .where(table.c.id == self.id, table.c.status == JobStatus.pending)
+                .values(status=JobStatus.running, heartbeat_at=datetime.utcnow())
+        ).rowcount == 1
+
+        db.session.commit()
+        return claimed
+
+    # fail the job if it's running without heartbeats, eg. after its worker restarted or crashed, so clients waiting on it stop
+    # stale jobs aren't run again, since their worker may have saved some of their questions
+    @hybrid_method
+    def fail_if_stale(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=current_app.config["GENERATION_JOB_LEASE"])
+        if self.status != JobStatus.running or (self.heartbeat_at is not None and self.heartbeat_at >= cutoff):
+            return
+
+        # only fail the job if no heartbeat arrived since it was read
+        table = GenerationJob.__table__
+        db.session.execute(
+            table.update()
+                .where(
+                    table.c.id == self.id,
+                    table.c.status == JobStatus.running,
+                    db.or_(table.c.heartbeat_at.is_(None), table.c.heartbeat_at < cutoff),
+                )
+                .values(status=JobStatus.failed, error=INTERRUPTED_JOB_MESSAGE)
+        )
+        db.session.commit()
+
+    @classmethod
+    def fail_stale_jobs(cls):
+        for job in cls.query.filter_by(status=JobStatus.running).all():
+            job.fail_if_stale()
+
+    @hybrid_method
+    def run(self):
+        job_id = self.id
+        table = GenerationJob.__table__
+        engine = db.engine
+
+        # renew the job's lease and write its progress from a thread outside of the job's session
+        # receives the shard index of each parsed question, then None once the job ends
+        interval = current_app.config["GENERATION_JOB_LEASE"] / 3
+        updates = queue.SimpleQueue()
+
+        def track(progress):
+            while True:
+                try:
+                    shards = [updates.get(timeout=interval)]
+                except queue.Empty:
+                    shards = []
+
+                # questions parsed during the last write are written together
+                while not updates.empty():
+                    shards.append(updates.get())
+
+                values = { "heartbeat_at": datetime.utcnow() }
+                for shard in shards:
+                    if shard is not None:
+                        progress[shard] += 1
+                        values["shard_progress"] = list(progress)
+
+                with engine.begin() as connection:
+                    connection.execute(table.update().where(table.c.id == job_id).values(**values))
+
+                if None in shards:
+                    return
+
+        tracker = None
+
+        try:
+            shards = self.generation.content_shards
+
+            self.shard_questions = [0] * len(shards)
+            for index, _, num_questions, *_ in shard_jobs(shards, self.num_questions, output_format=current_app.config["OUTPUT_FORMAT"]):
+                self.shard_questions[index] += num_questions
+
+            self.shard_progress = [0] * len(shards)
+
+            # end the session's transaction, so progress can be written while questions generate
+            db.session.commit()
+
+            tracker = threading.Thread(target=track, args=([0] * len(shards),), name=f"generation-job-{job_id}-tracker", daemon=True)
+            tracker.start()
+
+            # called from the LLM executor's thread, which only queues the update so the event loop never waits on the database
+            def on_question(shard, _):
+                updates.put(shard)
+
+            self.generation.add_questions(self.num_questions, self.custom_prompt, on_question, job_id)
+            self.status = JobStatus.completed
+        except Exception as e:
+            db.session.rollback()
+
+            self.status = JobStatus.failed
+            self.error = error_message(e)
+            current_app.logger.exception("Generation job %s failed", job_id)
+        finally:
+            # wait for the job's progress to be written before it's marked finished
+            if tracker is not None:
+                updates.put(None)
+                tracker.join()
+
+        db.session.commit()
+
+    # questions the job has saved with ids after `after`, oldest first
+    @hybrid_method
+    def questions_after(self, after=None):
+        return Question.query \
+            .filter(Question.job_id == self.id, Question.id > (after or 0)) \
+            .order_by(Question.id).all()
+
+    @hybrid_method
+    def finished(self):
+        return self.status in [JobStatus.completed, JobStatus.failed]
+
+    # the generation's unfinished job, None when it has none
+    @classmethod
+    def active(cls, generation_id):
+        job = cls.query \
+            .filter(cls.generation_id == generation_id, cls.status.in_([JobStatus.pending, JobStatus.running])) \
+            .first()
+
+        if job is not None:
+            job.fail_if_stale()
+
+        return None if job is None or job.finished() else job
+
+    @hybrid_method
+    def check_ownership(self, user_id):
+        self.generation.check_ownership(user_id)
+
+
 # user-provided message about experience using quizicist
 class Message(db.Model):
     id: int = db.Column(db.Integer, primary_key=True)
@@ -3,6 +3,7 @@ import { ALL_GENERATIONS_URL, API_URL } from "@shared/consts";
 import { FeedbackTypes, getNewFeedback } from "@shared/feedback.type";
 import Generation from "@shared/generation.type";
 import { deleteQuestionOptimistic, giveFeedbackOptimistic } from "./optimisticData";
+import useMutationJob from "./useMutationJob";
 import useMutationPost, { MutationPostOptions } from "./useMutationPost";
 
 const getGenerationURL = (generationId: number) => `${API_URL}/generated/${generationId}`;
@@ -29,9 +30,9 @@ export const useGenerationDelete = (generationId: number, options?: MutationPost
     return () => trigger();
 }
 
-/** Add multiple questions */
+/** Add multiple questions, resolving once they're generated */
 export const useQuestionAdd = (generationId: number, options?: MutationPostOptions) => {
-    const { trigger } = useMutationPost(
+    const { trigger } = useMutationJob(
         getGenerationURL(generationId),
         `${API_URL}/generated/${generationId}/more`,
         options
@@ -51,9 +52,9 @@ export const useGenerationUpdate = (generationId: number, options?: MutationPost
     return (data: any) => trigger(data);
 }
 
-/** Create a quiz */
+/** Create a quiz, resolving once its questions are generated */
 export const useGenerationCreate = (options?: MutationPostOptions) => {
-    const { trigger } = useMutationPost(
+    const { trigger } = useMutationJob(
         ALL_GENERATIONS_URL,
         `${API_URL}/upload`,
         options
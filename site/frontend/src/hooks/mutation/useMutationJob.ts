@@ -0,0 +1,47 @@
+import api from "@shared/api";
+import { API_URL, SERVER_URL } from "@shared/consts";
+import Job from "@shared/job.type";
+import Question from "@shared/question.type";
+import { mutate } from "swr";
+import useSWRMutation from "swr/mutation";
+import { FetcherResponse } from "swr/_internal";
+import { MutationPostOptions } from "./useMutationPost";
+
+/** Wait for a background generation job to finish, calling `onQuestion` as each of its questions is saved */
+export const waitForJob = (jobId: number, onQuestion?: (question: Question) => void) => new Promise<Job>((resolve, reject) => {
+    const events = new EventSource(`${SERVER_URL}${API_URL}/jobs/${jobId}/events`, { withCredentials: true });
+
+    events.addEventListener("question", event => {
+        onQuestion?.(JSON.parse((event as MessageEvent).data));
+    });
+
+    events.addEventListener("done", event => {
+        const job: Job = JSON.parse((event as MessageEvent).data);
+        events.close();
+
+        if (job.status === "failed") {
+            reject(new Error(job.error ?? "Question generation failed."));
+        } else {
+            resolve(job);
+        }
+    });
+
+    // the browser reconnects after dropped connections, only give up once it stops trying
+    events.onerror = () => {
+        if (events.readyState === EventSource.CLOSED) {
+            reject(new Error("Lost connection while generating questions."));
+        }
+    };
+});
+
+/** Start a background generation job, refreshing `mutationURL` as questions arrive and resolving once the job finishes */
+function useMutationJob<T>(mutationURL: string, postURL: string, options?: MutationPostOptions<T>) {
+    const post = async (_url: string, { arg }: any) => {
+        const { data } = await api.post(postURL, arg);
+        return await waitForJob(data.job, () => mutate(mutationURL)) as FetcherResponse<T>;
+    };
+
+    return useSWRMutation(mutationURL, post, options);
+}
+
+export default useMutationJob;
@@ -0,0 +1,10 @@
+type Job = {
+    id: number;
+    status: "pending" | "running" | "completed" | "failed";
+    num_questions: number;
+    shard_questions: number[];
+    shard_progress: number[];
+    error: string | null;
+};
+
+export default Job;
@@ -1,4 +1,9 @@
 # quizicist Gunicorn configuration file
+
+# patch before the preloaded app imports socket/ssl (gevent workers patch too late)
+from gevent import monkey
+monkey.patch_all()
+
 bind = "127.0.0.1:8000"
 backlog = 2048
 
@@ -9,3 +14,16 @@ timeout = 180
 keepalive = 2
 
 daemon = True
+
+# load app in master process, forked workers share its memory copy-on-write
+preload_app = True
+
+
+# warm shared tokenizer before workers are forked
+def when_ready(server):
+    import os
+    from quizicist.tokens import preload_tokenizers
+
+    # rust tokenizer thread pools don't survive forking
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    preload_tokenizers()
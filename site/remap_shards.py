@@ -0,0 +1,38 @@
+import json
+from backend.main import app
+from backend.db import db
+from backend.models import Generation
+from quizicist.content import shard_overlaps
+
+# if running as a script, store shards for quizzes created before shards were stored,
+# moving each of their questions to the shard sharing the most words with it
+# ties and questions sharing no words with any shard are printed, and keep their shard when it's still valid
+if __name__ == "__main__":
+    with app.app_context():
+        for generation in Generation.query.all():
+            if generation.shards is not None:
+                continue
+
+            try:
+                shards = generation.parsed_content["shards"]
+            except FileNotFoundError:
+                print(json.dumps({ "generation": generation.id, "error": "upload not found" }))
+                continue
+
+            questions = generation.questions
+            texts = [" ".join([question.question] + [answer.text for answer in question.answers]) for question in questions]
+
+            for question, overlaps in zip(questions, shard_overlaps(shards, texts)):
+                best = max(overlaps)
+                matches = [index for index, overlap in enumerate(overlaps) if overlap == best]
+
+                if len(matches) == 1 and best > 0:
+                    question.shard = matches[0]
+                    continue
+
+                print(json.dumps({ "generation": generation.id, "question": question.id, "shard": question.shard, "matches": matches, "overlap": best }))
+                if question.shard is None or not 0 <= question.shard < len(shards):
+                    question.shard = matches[0]
+
+            generation.shards = shards
+            db.session.commit()
@@ -0,0 +1,19 @@
+import asyncio
+import json
+from backend.main import app
+from backend.db import db
+from backend.models import Draft
+from quizicist.postprocess import convert_draft
+
+# if running as a script, retry conversion of drafts that failed to convert, storing converted questions with each draft
+# drafts are marked converted once all of their questions convert, so running again only retries the rest
+if __name__ == "__main__":
+    with app.app_context():
+        for draft in Draft.query.filter_by(converted=False).all():
+            questions = asyncio.run(convert_draft(draft.content, draft.prompt_type, draft.num_questions))
+
+            draft.questions = questions
+            draft.converted = len(questions) == draft.num_questions
+            db.session.commit()
+
+            print(json.dumps({ "draft": draft.id, "generation": draft.generation_id, "converted": draft.converted, "questions": len(questions) }))